@@ -0,0 +1,289 @@
+"""Reproducible benchmarks for WeatherAPI and the UI update path.
+
+Everything runs against benchmarks/mock_server.py, so no API quota is used
+and results only depend on the machine and the configured latency.
+
+    python benchmarks/bench.py
+    python benchmarks/bench.py --output baseline.json
+    python benchmarks/bench.py --baseline baseline.json --tolerance 0.25
+
+With --baseline the run exits with status 1 if any metric regressed by more
+than the tolerance, which is what CI should call.
+"""
+import argparse
+import json
+import os
+import random
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from dataclasses import replace
+from typing import Callable, Dict, List
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import weather
+from mock_server import MockOWMServer, load_recording
+
+FAVORITES = ["Duhok", "Erbil", "Kirkuk", "Mosul", "Sulaymaniyah"]
+
+# Metrics where a bigger number is better; everything else is a duration
+HIGHER_IS_BETTER = ("hit_rate", "_per_s")
+
+def percentile(samples: List[float], pct: float) -> float:
+    ordered = sorted(samples)
+    index = min(len(ordered) - 1, max(0, round(pct / 100 * len(ordered)) - 1))
+    return ordered[index]
+
+def make_api(server: MockOWMServer, **kwargs) -> weather.WeatherAPI:
+    # The mock has no quota, so the request budget would only measure itself
+    kwargs.setdefault("calls_per_minute", 0)
+    return weather.WeatherAPI(base_url=server.base_url, api_key="bench", **kwargs)
+
+def bench_cold_start(server: MockOWMServer, workdir: str) -> Dict[str, float]:
+    store_path = os.path.join(workdir, "cold_start.db")
+    start = time.perf_counter()
+    api = make_api(server, store=weather.WeatherStore(store_path))
+    current = api.get_current_weather_async(FAVORITES[0])
+    forecast = api.get_forecast_async(FAVORITES[0])
+    current.result(), forecast.result()
+    network_ms = (time.perf_counter() - start) * 1000
+    api.close()
+
+    # Second launch: first paint comes from the saved payloads
+    start = time.perf_counter()
+    api = make_api(server, store=weather.WeatherStore(store_path))
+    api.load_saved("weather", FAVORITES[0])
+    api.load_saved("forecast", FAVORITES[0])
+    saved_ms = (time.perf_counter() - start) * 1000
+    api.close()
+    return {"cold_start_network_ms": network_ms, "cold_start_saved_ms": saved_ms}
+
+def bench_search_latency(server: MockOWMServer, searches: int) -> Dict[str, float]:
+    api = make_api(server)
+    samples = []
+    for i in range(searches):
+        city = f"Search City {i}"
+        start = time.perf_counter()
+        current = api.get_current_weather_async(city)
+        forecast = api.get_forecast_async(city)
+        current.result(), forecast.result()
+        samples.append((time.perf_counter() - start) * 1000)
+    api.close()
+    return {
+        "search_p50_ms": percentile(samples, 50),
+        "search_p99_ms": percentile(samples, 99),
+    }
+
+def bench_cache_hit_rate(server: MockOWMServer, clicks: int) -> Dict[str, float]:
+    # Kiosk pattern: people clicking back and forth between the favorites
+    api = make_api(server)
+    rng = random.Random(42)
+    samples = []
+    for _ in range(clicks):
+        city = rng.choice(FAVORITES)
+        start = time.perf_counter()
+        api.get_current_weather(city)
+        api.get_forecast(city)
+        samples.append((time.perf_counter() - start) * 1000)
+    stats = api.cache.stats()
+    api.close()
+    return {
+        "cache_hit_rate": stats["hits"] / max(1, stats["hits"] + stats["misses"]),
+        "favorite_click_mean_ms": statistics.mean(samples),
+    }
+
+def bench_refresh_throughput(server: MockOWMServer, cities: int) -> Dict[str, float]:
+    api = make_api(server)
+    names = [f"Refresh City {i}" for i in range(cities)]
+
+    start = time.perf_counter()
+    api.get_current_weather_many(names)
+    cold = time.perf_counter() - start
+
+    # IDs are known now, so the next refresh goes through /group
+    api.cache.clear()
+    server.reset_counts()
+    start = time.perf_counter()
+    api.get_current_weather_many(names)
+    warm = time.perf_counter() - start
+    upstream_calls = sum(server.counts.values())
+    api.close()
+    return {
+        "refresh_cold_cities_per_s": cities / cold,
+        "refresh_group_cities_per_s": cities / warm,
+        "refresh_group_upstream_calls": upstream_calls,
+    }
+
+def bench_payload(server: MockOWMServer) -> Dict[str, float]:
+    # Bytes on the wire for a full forecast, and for revalidating it once expired
+    api = make_api(server)
+    api.get_forecast(FAVORITES[0])
+    full = weather.metrics.latest()["upstream_wire_bytes"]
+    key = api.cache_key("forecast", FAVORITES[0])
+    api.cache.set(key, api.cache.stale(key), 0)
+    start = time.perf_counter()
+    api.get_forecast(FAVORITES[0])
+    revalidate_ms = (time.perf_counter() - start) * 1000
+    revalidated = weather.metrics.latest()["upstream_wire_bytes"]
+    api.close()
+    return {
+        "forecast_wire_bytes": full,
+        "forecast_revalidate_wire_bytes": revalidated,
+        "forecast_revalidate_ms": revalidate_ms,
+    }
+
+def bench_geo(server: MockOWMServer, lookups: int) -> Dict[str, float]:
+    # Users scattered within a few km of the favorite cities, looked up by coordinates
+    api = make_api(server, city_index=weather.default_city_index())
+    rng = random.Random(7)
+    centres = [api.resolve_city(city) for city in FAVORITES]
+    server.reset_counts()
+    start = time.perf_counter()
+    for _ in range(lookups):
+        centre = rng.choice(centres)
+        api.get_current_weather_at(centre.lat + rng.uniform(-0.05, 0.05), centre.lon + rng.uniform(-0.05, 0.05))
+    elapsed = time.perf_counter() - start
+    upstream_calls = sum(server.counts.values())
+    api.close()
+    return {
+        "geo_lookup_mean_ms": elapsed / lookups * 1000,
+        "geo_hit_rate": 1 - upstream_calls / lookups,
+    }
+
+def bench_history(workdir: str, cities: int, iterations: int) -> Dict[str, float]:
+    # Three months of 5-minute observations per city, then the trend chart's 30-day query
+    history = weather.HistoryStore(os.path.join(workdir, "history.db"))
+    template = weather.CurrentConditions.from_json(load_recording("weather"))
+    rng = random.Random(3)
+    end = int(time.time())
+    start = end - 90 * 86400
+    for i in range(cities):
+        observations = []
+        for dt in range(start, end, 300):
+            observation = replace(template, dt=dt, temp=template.temp + rng.uniform(-8, 8))
+            observations.append((f"History City {i}", observation))
+        history.record_many(observations)
+
+    samples = []
+    for i in range(iterations):
+        begin = time.perf_counter()
+        history.query(f"History City {i % cities}", end - 30 * 86400, end)
+        samples.append((time.perf_counter() - begin) * 1000)
+    history.close()
+    return {
+        "history_query_p50_ms": percentile(samples, 50),
+        "history_query_p99_ms": percentile(samples, 99),
+    }
+
+def bench_startup(server: MockOWMServer, workdir: str, samples: int) -> Dict[str, float]:
+    # A returning user's launch, each in a fresh interpreter; the untimed first
+    # run creates the databases and saves the weather the later ones start from
+    data_dir = os.path.join(workdir, "startup")
+    os.makedirs(data_dir, exist_ok=True)
+    script = os.path.join(os.path.dirname(os.path.abspath(__file__)), "startup.py")
+    env = dict(os.environ, OWM_BASE_URL=server.base_url, OWM_CALLS_PER_MINUTE="0")
+    runs = []
+    for i in range(samples + 1):
+        probe = subprocess.run(
+            [sys.executable, script, "--city", FAVORITES[0], "--data-dir", data_dir],
+            env=env, capture_output=True, text=True, check=True
+        )
+        if i:
+            runs.append(json.loads(probe.stdout.strip().splitlines()[-1]))
+    return {
+        (name if name.startswith("startup_") else f"startup_{name}"): statistics.median(run[name] for run in runs)
+        for name in runs[0]
+    }
+
+def bench_ui(iterations: int) -> Dict[str, float]:
+    results = {}
+    current = weather.CurrentConditions.from_json(load_recording("weather"))
+    forecast = weather.Forecast.from_json(load_recording("forecast"))
+
+    start = time.perf_counter()
+    for _ in range(iterations):
+        weather.aggregate_daily(forecast)
+    results["aggregate_daily_us"] = (time.perf_counter() - start) / iterations * 1e6
+
+    try:
+        import flet  # noqa: F401
+    except ImportError:
+        print("flet is not installed; skipping control-build benchmarks", file=sys.stderr)
+        return results
+
+    start = time.perf_counter()
+    for _ in range(iterations):
+        weather.CurrentWeatherView(on_favorite=lambda city: None).show(current)
+    results["current_view_build_us"] = (time.perf_counter() - start) / iterations * 1e6
+
+    view = weather.CurrentWeatherView(on_favorite=lambda city: None)
+    view.show(current)
+    start = time.perf_counter()
+    for _ in range(iterations):
+        view.show(current)
+    results["current_view_refresh_us"] = (time.perf_counter() - start) / iterations * 1e6
+    return results
+
+def compare(results: Dict[str, float], baseline: Dict[str, float], tolerance: float) -> List[str]:
+    regressions = []
+    for name, value in results.items():
+        reference = baseline.get(name)
+        if not reference:
+            continue
+        if any(marker in name for marker in HIGHER_IS_BETTER):
+            regressed = value < reference * (1 - tolerance)
+        else:
+            regressed = value > reference * (1 + tolerance)
+        if regressed:
+            regressions.append(f"{name}: {value:.3f} vs baseline {reference:.3f}")
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description="Weather dashboard benchmarks")
+    parser.add_argument("--latency", type=float, default=50, help="mock upstream latency in ms")
+    parser.add_argument("--searches", type=int, default=100)
+    parser.add_argument("--clicks", type=int, default=500)
+    parser.add_argument("--cities", type=int, default=100)
+    parser.add_argument("--iterations", type=int, default=200)
+    parser.add_argument("--startup-samples", type=int, default=5, help="cold launches to time, one process each")
+    parser.add_argument("--output", help="write results as JSON to this file")
+    parser.add_argument("--baseline", help="compare against a previous --output file")
+    parser.add_argument("--tolerance", type=float, default=0.25)
+    args = parser.parse_args()
+
+    server = MockOWMServer(latency=args.latency / 1000, jitter=0.2, seed=1)
+    server.start()
+    results: Dict[str, float] = {}
+    with tempfile.TemporaryDirectory() as workdir:
+        benches: List[Callable[[], Dict[str, float]]] = [
+            lambda: bench_cold_start(server, workdir),
+            lambda: bench_search_latency(server, args.searches),
+            lambda: bench_cache_hit_rate(server, args.clicks),
+            lambda: bench_refresh_throughput(server, args.cities),
+            lambda: bench_payload(server),
+            lambda: bench_geo(server, args.clicks),
+            lambda: bench_history(workdir, args.cities, args.iterations),
+            lambda: bench_startup(server, workdir, args.startup_samples),
+            lambda: bench_ui(args.iterations),
+        ]
+        for bench in benches:
+            results.update(bench())
+    server.stop()
+
+    for name, value in results.items():
+        print(f"{name:32s} {value:12.3f}")
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+    if args.baseline:
+        with open(args.baseline, "r") as f:
+            regressions = compare(results, json.load(f), args.tolerance)
+        if regressions:
+            print("\nRegressions:", *regressions, sep="\n  ")
+            sys.exit(1)
+
+if __name__ == "__main__":
+    main()
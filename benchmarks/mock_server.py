@@ -0,0 +1,238 @@
+"""Offline stand-in for the OpenWeatherMap endpoints used by weather.py.
+
+Serves the sample payloads in benchmarks/recordings/ for /weather, /forecast
+and /group (by name, ID or lat/lon) and /geo/1.0/reverse, re-labelled for
+whichever place is asked for, with configurable
+latency, error rate and 429 throttling. Responses are gzipped when the client
+accepts it and carry an ETag and Last-Modified, so conditional requests get a
+304. Point the app or the benchmarks at it with OWM_BASE_URL:
+
+    python benchmarks/mock_server.py --port 8765 --latency 80 --throttle-rate 0.05
+    OWM_BASE_URL=http://127.0.0.1:8765/data/2.5 python weather.py
+"""
+import argparse
+import copy
+import gzip
+import json
+import os
+import random
+import threading
+import time
+import zlib
+from email.utils import formatdate
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, Optional, Tuple
+from urllib.parse import parse_qs, urlparse
+
+RECORDINGS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "recordings")
+
+def load_recording(name: str) -> Dict:
+    with open(os.path.join(RECORDINGS_DIR, f"{name}.json"), "r", encoding="utf-8") as f:
+        return json.load(f)
+
+class MockOWMServer:
+    def __init__(self, host: str = "127.0.0.1", port: int = 0, latency: float = 0.0, jitter: float = 0.2,
+                 error_rate: float = 0.0, throttle_rate: float = 0.0, unknown_cities=("Atlantis",),
+                 seed: int = 0, max_age: Optional[int] = None):
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.throttle_rate = throttle_rate
+        self.unknown_cities = {city.casefold() for city in unknown_cities}
+        # Sent as Cache-Control: max-age when set
+        self.max_age = max_age
+        self.last_modified = formatdate(time.time(), usegmt=True)
+        self.weather_template = load_recording("weather")
+        self.forecast_template = load_recording("forecast")
+        self.counts: Dict[str, int] = {}
+        self._names_by_id: Dict[int, str] = {self.weather_template["id"]: self.weather_template["name"]}
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self._server = ThreadingHTTPServer((host, port), self._handler_class())
+        self._server.daemon_threads = True
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def base_url(self) -> str:
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}/data/2.5"
+
+    def start(self) -> str:
+        self._thread = threading.Thread(target=self._server.serve_forever, name="mock-owm", daemon=True)
+        self._thread.start()
+        return self.base_url
+
+    def serve_forever(self):
+        try:
+            self._server.serve_forever()
+        finally:
+            self._server.server_close()
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def reset_counts(self):
+        with self._lock:
+            self.counts.clear()
+
+    def _roll(self) -> Tuple[float, float]:
+        with self._lock:
+            return self._random.random(), self._random.uniform(1 - self.jitter, 1 + self.jitter)
+
+    def _city_id(self, name: str) -> int:
+        if name.casefold() == self.weather_template["name"].casefold():
+            return self.weather_template["id"]
+        city_id = 1_000_000 + zlib.crc32(name.casefold().encode("utf-8")) % 9_000_000
+        with self._lock:
+            self._names_by_id[city_id] = name
+        return city_id
+
+    def _offsets(self, city_id: int) -> Tuple[float, float, float]:
+        # Stable per-city variation so different cities are distinguishable
+        if city_id == self.weather_template["id"]:
+            return 0.0, 0.0, 0.0
+        rng = random.Random(city_id)
+        return rng.uniform(-2, 2), rng.uniform(-2, 2), rng.uniform(-6, 6)
+
+    def current_payload(self, name: str, coord: Optional[Tuple[float, float]] = None) -> Dict:
+        payload = copy.deepcopy(self.weather_template)
+        city_id = self._city_id(name)
+        dlat, dlon, dtemp = self._offsets(city_id)
+        payload["id"] = city_id
+        payload["name"] = name
+        payload["coord"]["lat"] = round(payload["coord"]["lat"] + dlat, 4) if coord is None else coord[0]
+        payload["coord"]["lon"] = round(payload["coord"]["lon"] + dlon, 4) if coord is None else coord[1]
+        for field in ("temp", "feels_like", "temp_min", "temp_max"):
+            payload["main"][field] = round(payload["main"][field] + dtemp, 2)
+        return payload
+
+    def forecast_payload(self, name: str, cnt: Optional[int] = None, coord: Optional[Tuple[float, float]] = None) -> Dict:
+        payload = copy.deepcopy(self.forecast_template)
+        city_id = self._city_id(name)
+        dlat, dlon, dtemp = self._offsets(city_id)
+        payload["city"].update(id=city_id, name=name)
+        payload["city"]["coord"]["lat"] = round(payload["city"]["coord"]["lat"] + dlat, 4) if coord is None else coord[0]
+        payload["city"]["coord"]["lon"] = round(payload["city"]["coord"]["lon"] + dlon, 4) if coord is None else coord[1]
+        for item in payload["list"]:
+            for field in ("temp", "feels_like", "temp_min", "temp_max"):
+                item["main"][field] = round(item["main"][field] + dtemp, 2)
+        if cnt is not None:
+            payload["list"] = payload["list"][:cnt]
+        payload["cnt"] = len(payload["list"])
+        return payload
+
+    @staticmethod
+    def _coord(query: Dict) -> Optional[Tuple[float, float]]:
+        if "lat" in query and "lon" in query:
+            return float(query["lat"][0]), float(query["lon"][0])
+        return None
+
+    def _name_for(self, query: Dict) -> Optional[str]:
+        coord = self._coord(query)
+        if coord is not None:
+            # Every point gets its own made-up station, named after a ~1 km cell
+            return f"Place {coord[0]:.2f},{coord[1]:.2f}"
+        if "q" in query:
+            return query["q"][0].split(",")[0].strip()
+        if "id" in query:
+            city_id = int(query["id"][0])
+            with self._lock:
+                return self._names_by_id.get(city_id, f"City {city_id}")
+        return None
+
+    def respond(self, path: str, query: Dict) -> Tuple[int, Dict, Any]:
+        endpoint = path.rstrip("/").rsplit("/", 1)[-1]
+        with self._lock:
+            self.counts[endpoint] = self.counts.get(endpoint, 0) + 1
+        roll, scale = self._roll()
+        if self.latency:
+            time.sleep(self.latency * scale)
+        if roll < self.throttle_rate:
+            return 429, {"Retry-After": "1"}, {"cod": 429, "message": "Your account is temporary blocked"}
+        if roll < self.throttle_rate + self.error_rate:
+            return 503, {}, {"cod": 503, "message": "Service Unavailable"}
+        if "appid" not in query:
+            return 401, {}, {"cod": 401, "message": "Invalid API key"}
+
+        if endpoint == "group":
+            ids = [int(city_id) for city_id in query.get("id", [""])[0].split(",") if city_id]
+            with self._lock:
+                names = [self._names_by_id.get(city_id, f"City {city_id}") for city_id in ids]
+            items = [self.current_payload(name) for name in names]
+            return 200, {}, {"cnt": len(items), "list": items}
+        if endpoint == "reverse":
+            coord = self._coord(query)
+            if coord is None:
+                return 400, {}, {"cod": "400", "message": "Nothing to geocode"}
+            place = {"name": self._name_for(query), "lat": coord[0], "lon": coord[1], "country": "IQ"}
+            return 200, {}, [place]
+        name = self._name_for(query)
+        if endpoint not in ("weather", "forecast") or name is None:
+            return 404, {}, {"cod": "404", "message": "Internal error"}
+        if name.casefold() in self.unknown_cities:
+            return 404, {}, {"cod": "404", "message": "city not found"}
+        if endpoint == "weather":
+            return 200, {}, self.current_payload(name, self._coord(query))
+        cnt = int(query["cnt"][0]) if "cnt" in query else None
+        return 200, {}, self.forecast_payload(name, cnt, self._coord(query))
+
+    def _handler_class(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+            # Headers and body go out in separate writes; avoid the delayed-ACK stall
+            disable_nagle_algorithm = True
+
+            def do_GET(self):
+                url = urlparse(self.path)
+                status, headers, payload = server.respond(url.path, parse_qs(url.query))
+                body = json.dumps(payload, separators=(",", ":")).encode("utf-8")
+                if status == 200:
+                    # Payloads are deterministic per URL, so a body hash is a valid ETag
+                    headers["ETag"] = f'"{zlib.crc32(body):08x}"'
+                    headers["Last-Modified"] = server.last_modified
+                    if server.max_age is not None:
+                        headers["Cache-Control"] = f"max-age={server.max_age}"
+                    if self.headers.get("If-None-Match") == headers["ETag"]:
+                        status, body = 304, b""
+                if body and "gzip" in self.headers.get("Accept-Encoding", ""):
+                    body = gzip.compress(body, compresslevel=6)
+                    headers["Content-Encoding"] = "gzip"
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json; charset=utf-8")
+                self.send_header("Content-Length", str(len(body)))
+                for name, value in headers.items():
+                    self.send_header(name, value)
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
+
+def main():
+    parser = argparse.ArgumentParser(description="Local stand-in for the OpenWeatherMap API")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--latency", type=float, default=0, help="mean response latency in ms")
+    parser.add_argument("--jitter", type=float, default=0.2, help="latency jitter as a fraction of --latency")
+    parser.add_argument("--error-rate", type=float, default=0, help="fraction of requests answered with 503")
+    parser.add_argument("--throttle-rate", type=float, default=0, help="fraction of requests answered with 429")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--max-age", type=int, default=None, help="send Cache-Control: max-age with this many seconds")
+    args = parser.parse_args()
+
+    server = MockOWMServer(args.host, args.port, latency=args.latency / 1000, jitter=args.jitter,
+                           error_rate=args.error_rate, throttle_rate=args.throttle_rate, seed=args.seed,
+                           max_age=args.max_age)
+    print(f"Serving mock OpenWeatherMap at {server.base_url}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,87 @@
+"""Time one cold start of weather.py in a fresh interpreter.
+
+Prints a JSON object with the time to import weather.py, to import Flet,
+and, measured from the moment weatherapp() is called, to the first paint
+(header and search box), to the favorites and saved weather being on
+screen, and to the first favorite's live weather. The app runs in
+--data-dir (a fresh temporary directory by default) with --city as its
+only favorite; reuse a directory to time a returning user's launch, with
+the saved weather and databases from the previous run. bench.py runs this
+in a new process for every sample, since a warm interpreter would hide the
+import cost; it can also be run on its own:
+
+    OWM_BASE_URL=http://127.0.0.1:8765/data/2.5 python benchmarks/startup.py --city Erbil
+"""
+import argparse
+import json
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import time
+
+started = time.perf_counter()
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import weather  # noqa: E402
+
+imported = time.perf_counter()
+
+STAGES = ("startup_first_paint_ms", "startup_ready_ms", "startup_weather_ms")
+
+class ProbeWindow:
+    def center(self):
+        pass
+
+class ProbePage:
+    """Just enough of ft.Page for weatherapp() to run without a client."""
+
+    def __init__(self):
+        self.window = ProbeWindow()
+        self.overlay = []
+        self.controls = []
+
+    def add(self, *controls):
+        self.controls.extend(controls)
+        self.update()
+
+    def update(self, *controls):
+        pass
+
+    def run_thread(self, target, *args):
+        threading.Thread(target=target, args=args, daemon=True).start()
+
+def main():
+    parser = argparse.ArgumentParser(description="Time one cold start of the dashboard")
+    parser.add_argument("--city", default="Erbil", help="favorite opened on startup")
+    parser.add_argument("--data-dir", help="where the app keeps its files (default: a new temporary directory)")
+    args = parser.parse_args()
+
+    results = {"import_ms": (imported - started) * 1000}
+    if weather.ft is None:
+        print(json.dumps(results))
+        return
+    workdir = args.data_dir or tempfile.mkdtemp(prefix="weather-startup-")
+    os.chdir(workdir)
+    if not os.path.exists("favorite_cities.json"):
+        with open("favorite_cities.json", "w", encoding="utf-8") as f:
+            json.dump([args.city], f)
+    start = time.perf_counter()
+    weather.ft.Page  # noqa: B018 - resolves the lazy import
+    results["import_flet_ms"] = (time.perf_counter() - start) * 1000
+
+    weather.weatherapp(ProbePage())
+    deadline = time.monotonic() + 30
+    while "startup_weather_ms" not in weather.metrics.latest() and time.monotonic() < deadline:
+        time.sleep(0.005)
+    latest = weather.metrics.latest()
+    results.update((name, latest[name]) for name in STAGES if name in latest)
+    print(json.dumps(results))
+    if not args.data_dir:
+        shutil.rmtree(workdir, ignore_errors=True)
+    # Skip interpreter teardown; the refresher and pools are daemon threads
+    sys.stdout.flush()
+    os._exit(0)
+
+if __name__ == "__main__":
+    main()
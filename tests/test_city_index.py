@@ -0,0 +1,107 @@
+import json
+import os
+import random
+import sys
+import time
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import weather  # noqa: E402
+
+SYLLABLES = ["ba", "dar", "el", "gor", "ha", "kir", "la", "mos", "na", "ra", "sul", "ta", "zan", "ab", "ad", "kut"]
+
+def make_cities(count=400, seed=3):
+    # Made-up but similar-looking names, so typos have near misses to compete with
+    rng = random.Random(seed)
+    names = set()
+    while len(names) < count:
+        names.add("".join(rng.choice(SYLLABLES) for _ in range(rng.randint(2, 4))).capitalize())
+    return [
+        {"id": 1000 + i, "name": name, "country": "IQ",
+         "coord": {"lat": round(30 + i * 0.01, 4), "lon": round(40 + i * 0.01, 4)}}
+        for i, name in enumerate(sorted(names))
+    ]
+
+def typos(word):
+    # One deletion, substitution, insertion and transposition past the first letter
+    middle = len(word) // 2
+    yield word[:middle] + word[middle + 1:]
+    yield word[:middle] + ("x" if word[middle] != "x" else "y") + word[middle + 1:]
+    yield word[:middle] + "q" + word[middle:]
+    yield word[:middle] + word[middle + 1] + word[middle] + word[middle + 2:]
+
+@pytest.fixture
+def cities(tmp_path):
+    path = tmp_path / "city.list.json"
+    data = make_cities()
+    path.write_text(json.dumps(data), encoding="utf-8")
+    return str(path), data
+
+def test_build_and_lookup_round_trip(cities):
+    path, data = cities
+    index = weather.CityIndex(path)
+    assert len(index) == len(data)
+    assert os.path.exists(index.index_path)
+    for city in data:
+        match = index.lookup(city["name"].upper())
+        assert match is not None
+        assert (match.name, match.country, match.city_id) == (city["name"], "IQ", city["id"])
+        assert match.lat == pytest.approx(city["coord"]["lat"], abs=1e-4)
+        assert match.lon == pytest.approx(city["coord"]["lon"], abs=1e-4)
+    assert index.lookup("Nowhere at all") is None
+
+    # A second instance maps the index already built instead of rebuilding it
+    built_at = os.path.getmtime(index.index_path)
+    assert len(weather.CityIndex(path)) == len(data)
+    assert os.path.getmtime(index.index_path) == built_at
+
+def test_prefix_suggestions(cities):
+    path, data = cities
+    index = weather.CityIndex(path)
+    prefix = data[0]["name"][:3]
+    expected = [city["name"] for city in data if city["name"].startswith(prefix)][:8]
+    assert [match.name for match in index.suggest(prefix.lower())] == expected
+
+def test_typo_recall(cities):
+    path, data = cities
+    index = weather.CityIndex(path)
+    keys = [weather.normalize_city_name(city["name"]) for city in data]
+    words = [city["name"] for city in data if len(city["name"]) >= 5]
+    found = total = 0
+    for word in words:
+        for typo in typos(word.lower()):
+            if any(key.startswith(typo) for key in keys):
+                # Still the start of a real name, so not a typo here
+                continue
+            total += 1
+            found += word in [match.name for match in index.suggest(typo)]
+    assert total > 500
+    assert found / total >= 0.95
+
+def test_aliases_from_the_bundled_list(tmp_path):
+    source = os.path.join(os.path.dirname(weather.__file__), "cities.csv")
+    index = weather.CityIndex(source, str(tmp_path / "cities.idx"))
+    assert index.lookup("Hewler").name == "Erbil"
+    assert [match.name for match in index.suggest("Dahk")] == ["Duhok"]
+
+def test_old_format_index_is_rebuilt(cities, tmp_path):
+    path, data = cities
+    index_path = str(tmp_path / "old.idx")
+    with open(index_path, "wb") as f:
+        f.write(b"WXCIDX01" + bytes(64))
+    index = weather.CityIndex(path, index_path)
+    assert len(index) == len(data)
+    assert index.lookup(data[5]["name"]).city_id == data[5]["id"]
+
+def test_nearest_waits_for_the_background_grid(cities):
+    path, data = cities
+    index = weather.CityIndex(path)
+    city = data[10]
+    lat, lon = city["coord"]["lat"], city["coord"]["lon"]
+    deadline = time.monotonic() + 5
+    match = index.nearest(lat, lon, 0.5)
+    while match is None and time.monotonic() < deadline:
+        time.sleep(0.01)
+        match = index.nearest(lat, lon, 0.5)
+    assert match is not None and match.city_id == city["id"]
@@ -0,0 +1,169 @@
+import json
+import os
+import sys
+import time
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import weather  # noqa: E402
+
+DUHOK = weather.CityMatch("Duhok", "IQ", 36.8669, 42.9503, 98182)
+
+def resolve(name):
+    # Just enough gazetteer for the Duhok/Dahuk alias
+    return DUHOK if weather.normalize_city_name(name) in ("duhok", "dahuk", "dohuk") else None
+
+def write_json(path, data):
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(data, f)
+
+def read_json(path):
+    with open(path, encoding="utf-8") as f:
+        return json.load(f)
+
+def test_version_1_list_is_migrated(tmp_path):
+    path = str(tmp_path / "favorites.json")
+    write_json(path, ["Erbil", "Kirkuk"])
+    store = weather.FavoritesStore(path)
+    assert store.names == ["Erbil", "Kirkuk"]
+
+    store.add(weather.FavoriteCity("Mosul", "IQ", 99072, 36.335, 43.1189))
+    store.flush()
+    data = read_json(path)
+    assert data["version"] == weather.FavoritesStore.VERSION
+    assert [entry["name"] for entry in data["favorites"]] == ["Erbil", "Kirkuk", "Mosul"]
+    assert data["favorites"][2]["id"] == 99072
+
+def test_migration_fills_in_gazetteer_details(tmp_path):
+    path = str(tmp_path / "favorites.json")
+    write_json(path, ["dahuk"])
+    store = weather.FavoritesStore(path, resolve=resolve)
+    [entry] = store.entries
+    assert (entry.name, entry.country, entry.city_id) == ("Duhok", "IQ", 98182)
+
+def test_spellings_of_one_city_are_listed_once(tmp_path):
+    path = str(tmp_path / "favorites.json")
+    write_json(path, {"version": 2, "favorites": ["Duhok", "Dahuk", {"name": "DOHUK"}, "Erbil"]})
+    store = weather.FavoritesStore(path, resolve=resolve)
+    assert store.names == ["Duhok", "Erbil"]
+    assert not store.add(weather.FavoriteCity("Dahuk", "", 0, None, None))
+    assert not store.add(weather.FavoriteCity("Somewhere", "", 98182, None, None))
+    assert store.names == ["Duhok", "Erbil"]
+
+def test_corrupt_file_is_kept_aside(tmp_path):
+    path = str(tmp_path / "favorites.json")
+    with open(path, "w", encoding="utf-8") as f:
+        f.write('{"version": 2, "favorites": [')
+    store = weather.FavoritesStore(path)
+    assert store.names == weather.FavoritesStore.DEFAULTS
+    assert not os.path.exists(path)
+    [backup] = [name for name in os.listdir(tmp_path) if name.startswith("favorites.json.corrupt-")]
+    with open(tmp_path / backup, encoding="utf-8") as f:
+        assert f.read() == '{"version": 2, "favorites": ['
+
+def test_newer_version_is_read_but_never_written(tmp_path):
+    path = str(tmp_path / "favorites.json")
+    saved = {"version": weather.FavoritesStore.VERSION + 1, "favorites": [{"name": "Erbil", "pinned": True}]}
+    write_json(path, saved)
+    store = weather.FavoritesStore(path)
+    assert store.read_only
+    assert store.names == ["Erbil"]
+
+    store.add(weather.FavoriteCity("Mosul", "", 0, None, None))
+    store.flush()
+    assert read_json(path) == saved
+    assert os.listdir(tmp_path) == ["favorites.json"]
+
+def test_changes_are_written_once_they_settle(tmp_path):
+    writes = []
+
+    class CountingStore(weather.FavoritesStore):
+        def _write(self, data):
+            writes.append([entry["name"] for entry in data["favorites"]])
+
+    store = CountingStore(str(tmp_path / "favorites.json"), delay=0.2)
+    for name in ("Basra", "Najaf", "Karbala"):
+        store.add(weather.FavoriteCity(name, "", 0, None, None))
+        time.sleep(0.1)
+    time.sleep(0.4)
+    assert writes == [weather.FavoritesStore.DEFAULTS + ["Basra", "Najaf", "Karbala"]]
+
+def test_failed_write_is_retried(tmp_path):
+    attempts = []
+
+    class FlakyStore(weather.FavoritesStore):
+        RETRY_DELAY = 0.05
+
+        def _write(self, data):
+            attempts.append(data)
+            if len(attempts) == 1:
+                raise OSError("disk full")
+
+    store = FlakyStore(str(tmp_path / "favorites.json"), delay=0.01)
+    store.add(weather.FavoriteCity("Basra", "", 0, None, None))
+    deadline = time.monotonic() + 2
+    while len(attempts) < 2 and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert len(attempts) == 2
+    assert attempts[1]["favorites"][-1]["name"] == "Basra"
+
+def test_read_only_store_reports_a_corrupt_file_and_leaves_it_alone(tmp_path):
+    path = str(tmp_path / "favorites.json")
+    with open(path, "w", encoding="utf-8") as f:
+        f.write("not json")
+    with pytest.raises(ValueError):
+        weather.FavoritesStore(path, read_only=True)
+    assert os.listdir(tmp_path) == ["favorites.json"]
+
+def test_read_only_store_reports_a_missing_file(tmp_path):
+    with pytest.raises(FileNotFoundError):
+        weather.FavoritesStore(str(tmp_path / "favorites.json"), read_only=True)
+
+def test_read_only_store_reads_a_saved_list(tmp_path):
+    path = str(tmp_path / "favorites.json")
+    write_json(path, {"version": 2, "favorites": [{"name": "Erbil"}]})
+    assert weather.FavoritesStore(path, read_only=True).names == ["Erbil"]
+
+class FakeClientStorage:
+    def __init__(self, accept=True):
+        self.accept = accept
+        self.values = {}
+        self.sets = 0
+
+    def get(self, key):
+        return self.values.get(key)
+
+    def set(self, key, value):
+        self.sets += 1
+        if self.accept:
+            self.values[key] = value
+        return self.accept
+
+def test_rejected_client_write_is_not_counted_as_saved():
+    storage = FakeClientStorage(accept=False)
+    store = weather.ClientFavoritesStore(storage, delay=0.01)
+    store.RETRY_DELAY = 0.05
+    store.add(weather.FavoriteCity("Basra", "", 0, None, None))
+    deadline = time.monotonic() + 2
+    while storage.sets < 2 and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert storage.sets >= 2
+
+    storage.accept = True
+    store.flush()
+    assert storage.values["weather.favorites"]["favorites"][-1]["name"] == "Basra"
+
+def test_closed_store_stops_retrying():
+    storage = FakeClientStorage(accept=False)
+    store = weather.ClientFavoritesStore(storage, delay=0.01)
+    store.RETRY_DELAY = 0.05
+    store.add(weather.FavoriteCity("Basra", "", 0, None, None))
+    time.sleep(0.1)
+    store.close()
+    sets = storage.sets
+    time.sleep(0.2)
+    assert storage.sets == sets
+    store.add(weather.FavoriteCity("Najaf", "", 0, None, None))
+    store.flush()
+    assert storage.sets == sets
@@ -0,0 +1,62 @@
+import os
+import sys
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.join(ROOT, "benchmarks"))
+import weather  # noqa: E402
+from mock_server import MockOWMServer  # noqa: E402
+
+@pytest.fixture(scope="module")
+def server():
+    server = MockOWMServer(seed=1)
+    server.start()
+    yield server
+    server.stop()
+
+@pytest.fixture
+def api(server, tmp_path):
+    # A zero TTL makes every call after the first a conditional request
+    api = weather.WeatherAPI(base_url=server.base_url, api_key="test", calls_per_minute=0, forecast_ttl=0,
+                             store=weather.WeatherStore(str(tmp_path / "cache.db")))
+    statuses = []
+    request = api._request
+
+    def recording_request(*args, **kwargs):
+        response = request(*args, **kwargs)
+        statuses.append(response.status_code)
+        return response
+
+    api._request = recording_request
+    api.statuses = statuses
+    yield api
+    api.close()
+
+def test_short_forecast_does_not_replace_the_full_one(api):
+    assert len(api.get_forecast("Erbil", points=16)) == 16
+    assert len(api.get_forecast("Erbil")) == weather.WeatherAPI.FORECAST_POINTS
+    assert api.statuses == [200, 200]
+
+    fetched_at, saved = api.load_saved("forecast", "Erbil")
+    assert len(saved) == weather.WeatherAPI.FORECAST_POINTS
+
+def test_each_size_revalidates_to_its_own_size(api):
+    api.get_forecast("Erbil", points=16)
+    api.get_forecast("Erbil")
+    assert len(api.get_forecast("Erbil", points=16)) == 16
+    assert len(api.get_forecast("Erbil")) == weather.WeatherAPI.FORECAST_POINTS
+    assert len(api.get_forecast("Erbil", points=16)) == 16
+    assert api.statuses == [200, 200, 304, 304, 304]
+    assert len(api.load_saved("forecast", "Erbil")[1]) == weather.WeatherAPI.FORECAST_POINTS
+
+def test_full_forecast_serves_shorter_requests(server, tmp_path):
+    api = weather.WeatherAPI(base_url=server.base_url, api_key="test", calls_per_minute=0)
+    try:
+        api.get_forecast("Mosul")
+        server.reset_counts()
+        assert len(api.get_forecast("Mosul", points=8)) == weather.WeatherAPI.FORECAST_POINTS
+        assert server.counts == {}
+    finally:
+        api.close()
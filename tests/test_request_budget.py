@@ -0,0 +1,53 @@
+import os
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import weather  # noqa: E402
+
+INTERACTIVE = weather.RequestBudget.INTERACTIVE
+BACKGROUND = weather.RequestBudget.BACKGROUND
+
+def test_background_leaves_the_reserve_alone():
+    budget = weather.RequestBudget(calls_per_minute=60, burst=4, reserve=0.25)
+    granted = 0
+    while budget.acquire(BACKGROUND, timeout=0):
+        granted += 1
+    # One token of four is kept back for searches
+    assert granted == 3
+    assert budget.acquire(INTERACTIVE, timeout=0)
+
+def test_interactive_request_goes_first():
+    # One token every 100 ms, none left to start with
+    budget = weather.RequestBudget(calls_per_minute=600, burst=2, reserve=0.2)
+    while budget.acquire(INTERACTIVE, timeout=0):
+        pass
+    order = []
+
+    def take(priority, name):
+        if budget.acquire(priority, timeout=2):
+            order.append(name)
+
+    background = threading.Thread(target=take, args=(BACKGROUND, "background"))
+    background.start()
+    time.sleep(0.02)
+    interactive = threading.Thread(target=take, args=(INTERACTIVE, "interactive"))
+    interactive.start()
+    background.join()
+    interactive.join()
+    assert order == ["interactive", "background"]
+
+def test_penalize_blocks_new_calls_until_retry_after():
+    budget = weather.RequestBudget(calls_per_minute=600, burst=10)
+    budget.penalize(0.3)
+    assert budget.wait_time() > 0.2
+    assert not budget.acquire(INTERACTIVE, timeout=0.1)
+    assert not budget.acquire(BACKGROUND, timeout=0)
+    time.sleep(0.25)
+    assert budget.acquire(INTERACTIVE, timeout=0.5)
+
+def test_penalize_without_retry_after_uses_the_default():
+    budget = weather.RequestBudget(calls_per_minute=600)
+    budget.penalize()
+    assert budget.wait_time() > weather.RequestBudget.DEFAULT_RETRY_AFTER - 1
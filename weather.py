@@ -1,562 +1,3375 @@
-import flet as ft
-import requests
-import json
-import datetime
-from typing import Dict, Optional
-
-class WeatherAPI:
-    def __init__(self):
-        self.base_url = "http://api.openweathermap.org/data/2.5"
-        self.api_key = "7f8aeed7e99abbbb6ec7b12c630cb84d"
-
-    def get_current_weather(self, city: str) -> Optional[Dict]:
-        try:
-            url = f"{self.base_url}/weather"
-            params = {
-                "q": city,
-                "appid": self.api_key,
-                "units": "metric"
-            }
-            response = requests.get(url=url, params=params)
-
-            if response.status_code == 200:
-                return response.json()
-            else:
-                print(f"API Error: {response.status_code} - {response.text}")
-                return None
-        except Exception as e:
-            print(f"Error fetching weather: {e}")
-            return None
-
-    def get_forecast(self, city: str) -> Optional[Dict]:
-        try:
-            url = f"{self.base_url}/forecast"
-            params = {
-                "q": city,
-                "appid": self.api_key,
-                "units": "metric"
-            }
-            response = requests.get(url=url, params=params)
-            if response.status_code == 200:
-                return response.json()
-            else:
-                print(f"Forecast API Error: {response.status_code} - {response.text}")
-                return None
-        except Exception as e:
-            print(f"Error fetching forecast: {e}")
-            return None
-
-class WeatherApp:
-    def __init__(self):
-        self.weather_api = WeatherAPI()
-        self.favorite_file = "favorite_cities.json"
-        self.favorites = self.load_favorites()
-
-    def load_favorites(self):
-        try:
-            with open(self.favorite_file, 'r') as f:
-                return json.load(f)
-        except:
-            return ['Duhok', 'Erbil', 'Kirkuk', 'Mosul', 'Sulaymaniah']
-
-    def save_favorites(self):
-        try:
-            with open(self.favorite_file, 'w') as f:
-                json.dump(self.favorites, f)
-        except Exception as e:
-            print(f"Error saving favorites: {e}")
-
-    def add_favorite(self, city: str):
-        if city not in self.favorites:
-            self.favorites.append(city)
-            self.save_favorites()
-
-    def remove_favorite(self, city: str):
-        if city in self.favorites:
-            self.favorites.remove(city)
-            self.save_favorites()
-
-def weatherapp(page: ft.Page):
-    page.title = "Weather Dashboard"
-    page.theme_mode = ft.ThemeMode.LIGHT
-    page.padding = 10
-    page.window.width = 1200
-    page.window.height = 700
-    page.window.center()
-    page.scroll = ft.ScrollMode.HIDDEN
-    
-    # Try to set icon, but don't fail if file doesn't exist
-    try:
-        page.window.icon = "weather.ico"
-    except:
-        pass
-    
-    weather_app = WeatherApp()
-    
-    def search_weather():
-        city = city_input.value.strip()
-        if not city:
-            status_text.value = "Please enter a city name"
-            status_text.color = ft.Colors.RED_400
-            page.update()
-            return
-        
-        status_text.value = "Loading weather data..."
-        status_text.color = ft.Colors.BLUE_400
-        page.update()
-        
-        current_weather = weather_app.weather_api.get_current_weather(city)
-        if current_weather:
-            current_weather_card.content = create_current_weather_display(current_weather).content
-            status_text.value = f"Weather data loaded for {current_weather['name']}"
-            status_text.color = ft.Colors.GREEN_600
-            
-            # Get forecast
-            forecast_data = weather_app.weather_api.get_forecast(city=city)
-            if forecast_data:
-                update_forecast_display(forecast_data)
-        else:
-            status_text.value = f"Could not find weather data for '{city}'. Please check the city name and try again."
-            status_text.color = ft.Colors.RED_400
-        
-        page.update()
-
-    # UI Components
-    city_input = ft.TextField(
-        label="Enter city name", 
-        hint_text="e.g., Erbil, Duhok, Baghdad, London", 
-        expand=True, 
-        on_submit=lambda e: search_weather(),
-        border_radius=10
-    )
-    
-    search_button = ft.ElevatedButton(
-        "Search Weather", 
-        icon=ft.Icons.SEARCH, 
-        on_click=lambda e: search_weather(),
-        style=ft.ButtonStyle(
-            bgcolor=ft.Colors.BLUE_600, 
-            color=ft.Colors.WHITE,
-            shape=ft.RoundedRectangleBorder(radius=10)
-        ),
-        height=50
-    )
-    
-    current_weather_card = ft.Container(
-        content=ft.Column(
-            controls=[
-                ft.Icon(ft.Icons.CLOUD, size=60, color=ft.Colors.GREY_400),
-                ft.Text("Enter a city name and click search to view current weather", 
-                       size=16, 
-                       text_align=ft.TextAlign.CENTER,
-                       color=ft.Colors.GREY_600)
-            ],
-            horizontal_alignment=ft.CrossAxisAlignment.CENTER,
-            spacing=20
-        ),
-        padding=30,
-        bgcolor=ft.Colors.BLUE_50,
-        border_radius=15,
-        height=320,
-        alignment=ft.alignment.center
-    )
-    
-    forecast_container = ft.Row(
-        controls=[],
-        scroll=ft.ScrollMode.AUTO,
-        spacing=10
-    )
-    
-    favorites_container = ft.Column()
-    status_text = ft.Text("Ready to search for weather data", color=ft.Colors.GREY_600, size=14)
-
-    def get_weather_icon(weather_code: str) -> str:
-        icon_map = {
-            "01d": "☀️", "01n": "🌙",  # Clear sky
-            "02d": "⛅", "02n": "⛅",  # Few clouds
-            "03d": "☁️", "03n": "☁️",  # Scattered clouds
-            "04d": "☁️", "04n": "☁️",  # Broken clouds
-            "09d": "🌧️", "09n": "🌧️",  # Shower rain
-            "10d": "🌦️", "10n": "🌧️",  # Rain
-            "11d": "⛈️", "11n": "⛈️",  # Thunderstorm
-            "13d": "❄️", "13n": "❄️",  # Snow
-            "50d": "🌫️", "50n": "🌫️",  # Mist
-        }
-        return icon_map.get(weather_code, "🌤️")
-
-    def create_current_weather_display(weather_data: Dict):
-        main = weather_data['main']
-        weather = weather_data['weather'][0]
-        wind = weather_data.get("wind", {})
-
-        city_name = weather_data['name']
-        country = weather_data['sys']['country']
-        temp = round(main['temp'])
-        feels_like = round(main.get('feels_like', 0))
-        humidity = main.get('humidity', 0)
-        pressure = main['pressure']
-        wind_speed = wind.get("speed", 0)
-        description = weather["description"].title()
-        icon = get_weather_icon(weather["icon"])
-        
-        # Convert sunrise/sunset from Unix timestamp
-        sunrise = datetime.datetime.fromtimestamp(weather_data['sys']['sunrise']).strftime("%I:%M %p")
-        sunset = datetime.datetime.fromtimestamp(weather_data['sys']['sunset']).strftime("%I:%M %p")
-
-        return ft.Container(
-            content=ft.Column(
-                controls=[
-                    ft.Row(
-                        controls=[
-                            ft.Text(f"{city_name}, {country}", size=26, weight=ft.FontWeight.BOLD),
-                            ft.IconButton(
-                                ft.Icons.FAVORITE_BORDER, 
-                                icon_color=ft.Colors.RED_400, 
-                                on_click=lambda e: add_to_favorites(city_name),
-                                tooltip="Add to favorites",
-                                icon_size=28
-                            )
-                        ],
-                        alignment=ft.MainAxisAlignment.SPACE_BETWEEN
-                    ),
-                    ft.Text(
-                        datetime.datetime.now().strftime("%A, %B %d, %Y - %I:%M %p"), 
-                        size=14, 
-                        color=ft.Colors.GREY_500
-                    ),
-                    ft.Row(
-                        controls=[
-                            ft.Column(
-                                controls=[
-                                    ft.Text(icon, size=100),
-                                    ft.Text(description, size=18, weight=ft.FontWeight.BOLD, text_align=ft.TextAlign.CENTER)
-                                ],
-                                horizontal_alignment=ft.CrossAxisAlignment.CENTER,
-                                spacing=10
-                            ),
-                            ft.Column(
-                                controls=[
-                                    ft.Text(f"{temp}°C", size=54, weight=ft.FontWeight.BOLD, color=ft.Colors.BLUE_800),
-                                    ft.Text(f"Feels like {feels_like}°C", size=16, color=ft.Colors.GREY_600),
-                                ],
-                                horizontal_alignment=ft.CrossAxisAlignment.CENTER,
-                                spacing=5
-                            )
-                        ],
-                        alignment=ft.MainAxisAlignment.SPACE_AROUND
-                    ),
-                    ft.Row(
-                        controls=[
-                            ft.Container(
-                                content=ft.Column(
-                                    controls=[
-                                        ft.Icon(ft.Icons.WATER_DROP, color=ft.Colors.BLUE_400, size=20),
-                                        ft.Text("Humidity", size=12, color=ft.Colors.GREY_600),
-                                        ft.Text(f"{humidity}%", size=16, weight=ft.FontWeight.BOLD),
-                                    ],
-                                    horizontal_alignment=ft.CrossAxisAlignment.CENTER,
-                                    spacing=5
-                                ),
-                                expand=True
-                            ),
-                            ft.Container(
-                                content=ft.Column(
-                                    controls=[
-                                        ft.Icon(ft.Icons.AIR, color=ft.Colors.GREY_600, size=20),
-                                        ft.Text("Wind", size=12, color=ft.Colors.GREY_600),
-                                        ft.Text(f"{wind_speed} m/s", size=16, weight=ft.FontWeight.BOLD),
-                                    ],
-                                    horizontal_alignment=ft.CrossAxisAlignment.CENTER,
-                                    spacing=5
-                                ),
-                                expand=True
-                            ),
-                            ft.Container(
-                                content=ft.Column(
-                                    controls=[
-                                        ft.Icon(ft.Icons.SPEED, color=ft.Colors.ORANGE_400, size=20),
-                                        ft.Text("Pressure", size=12, color=ft.Colors.GREY_600),
-                                        ft.Text(f"{pressure} hPa", size=16, weight=ft.FontWeight.BOLD),
-                                    ],
-                                    horizontal_alignment=ft.CrossAxisAlignment.CENTER,
-                                    spacing=5
-                                ),
-                                expand=True
-                            ),
-                            ft.Container(
-                                content=ft.Column(
-                                    controls=[
-                                        ft.Icon(ft.Icons.WB_SUNNY, color=ft.Colors.YELLOW_600, size=20),
-                                        ft.Text("Sunrise", size=12, color=ft.Colors.GREY_600),
-                                        ft.Text(sunrise, size=16, weight=ft.FontWeight.BOLD),
-                                    ],
-                                    horizontal_alignment=ft.CrossAxisAlignment.CENTER,
-                                    spacing=5
-                                ),
-                                expand=True
-                            ),
-                            ft.Container(
-                                content=ft.Column(
-                                    controls=[
-                                        ft.Icon(ft.Icons.NIGHTLIGHT, color=ft.Colors.PURPLE_400, size=20),
-                                        ft.Text("Sunset", size=12, color=ft.Colors.GREY_600),
-                                        ft.Text(sunset, size=16, weight=ft.FontWeight.BOLD),
-                                    ],
-                                    horizontal_alignment=ft.CrossAxisAlignment.CENTER,
-                                    spacing=5
-                                ),
-                                expand=True
-                            ),
-                        ],
-                        spacing=10
-                    )
-                ],
-                spacing=15
-            ),
-            padding=25,
-            bgcolor=ft.Colors.BLUE_50,
-            border_radius=15,
-            height=320
-        )
-
-    def create_forecast_card(forecast_item: Dict):
-        dt = datetime.datetime.fromtimestamp(forecast_item['dt'])
-        temp = round(forecast_item['main']['temp'])
-        temp_min = round(forecast_item['main']['temp_min'])
-        temp_max = round(forecast_item['main']['temp_max'])
-        weather = forecast_item['weather'][0]
-        icon = get_weather_icon(weather['icon'])
-        description = weather['description'].title()
-
-        return ft.Container(
-            content=ft.Column(
-                controls=[
-                    ft.Text(dt.strftime("%a"), size=16, weight=ft.FontWeight.BOLD),
-                    ft.Text(dt.strftime("%m/%d"), size=12, color=ft.Colors.GREY_600),
-                    ft.Text(icon, size=36),
-                    ft.Text(f"{temp}°C", size=18, weight=ft.FontWeight.BOLD, color=ft.Colors.BLUE_800),
-                    ft.Text(f"{temp_min}° / {temp_max}°", size=12, color=ft.Colors.GREY_600),
-                    ft.Text(description, size=10, color=ft.Colors.GREY_600, text_align=ft.TextAlign.CENTER),
-                ],
-                horizontal_alignment=ft.CrossAxisAlignment.CENTER,
-                spacing=5
-            ),
-            padding=15,
-            bgcolor=ft.Colors.WHITE,
-            border=ft.border.all(2, ft.Colors.BLUE_200),
-            border_radius=12,
-            width=130,
-            margin=ft.margin.only(right=10)
-        )
-
-    def create_favorite_card(city: str):
-        def load_city_weather(e):
-            city_input.value = city
-            search_weather()
-        
-        def remove_from_favorites(e):
-            weather_app.remove_favorite(city=city)
-            update_favorites_display()
-            # Show removal confirmation
-            snackbar = ft.SnackBar(
-                content=ft.Text(f"Removed {city} from favorites"),
-                bgcolor=ft.Colors.ORANGE_600
-            )
-            page.overlay.append(snackbar)
-            snackbar.open = True
-            page.update()
-        
-        return ft.Container(
-            content=ft.Row(
-                controls=[
-                    ft.Icon(ft.Icons.LOCATION_CITY, color=ft.Colors.BLUE_400, size=20),
-                    ft.Text(city, size=16, expand=True, weight=ft.FontWeight.W_500),
-                    ft.IconButton(
-                        ft.Icons.DELETE_OUTLINE, 
-                        icon_color=ft.Colors.RED_400, 
-                        on_click=remove_from_favorites, 
-                        tooltip="Remove from favorites",
-                        icon_size=20
-                    )
-                ],
-                spacing=10
-            ),
-            padding=12,
-            bgcolor=ft.Colors.GREY_50,
-            border_radius=10,
-            margin=ft.margin.only(bottom=8),
-            on_click=load_city_weather,
-            ink=True,
-            border=ft.border.all(1, ft.Colors.GREY_200)
-        )
-
-    def update_forecast_display(forecast_data: Dict):
-        forecast_container.controls.clear()
-        # Show next 5 days
-        daily_forecasts = []
-        seen_dates = set()
-        
-        for item in forecast_data['list']:
-            dt = datetime.datetime.fromtimestamp(item["dt"])
-            date_str = dt.strftime("%Y-%m-%d")
-
-            if date_str not in seen_dates and len(daily_forecasts) < 5:
-                # Prefer forecasts around noon (12:00)
-                if dt.hour >= 12 or len(daily_forecasts) == 0:
-                    daily_forecasts.append(item)
-                    seen_dates.add(date_str)
-        
-        for forecast_item in daily_forecasts:
-            forecast_container.controls.append(create_forecast_card(forecast_item))
-        
-        page.update()
-
-    def add_to_favorites(city: str):
-        if city not in weather_app.favorites:
-            weather_app.add_favorite(city)
-            update_favorites_display()
-            snackbar = ft.SnackBar(
-                content=ft.Text(f"Added {city} to favorites! ⭐"),
-                bgcolor=ft.Colors.GREEN_600
-            )
-            page.overlay.append(snackbar)
-            snackbar.open = True
-            page.update()
-        else:
-            snackbar = ft.SnackBar(
-                content=ft.Text(f"{city} is already in your favorites"),
-                bgcolor=ft.Colors.ORANGE_600
-            )
-            page.overlay.append(snackbar)
-            snackbar.open = True
-            page.update()
-
-    def update_favorites_display():
-        favorites_container.controls.clear()
-        favorites_container.controls.append(
-            ft.Row(
-                controls=[
-                    ft.Icon(ft.Icons.FAVORITE, color=ft.Colors.RED_400, size=24),
-                    ft.Text("Favorite Cities", size=20, weight=ft.FontWeight.BOLD)
-                ],
-                spacing=10
-            )
-        )
-        
-        if weather_app.favorites:
-            for city in weather_app.favorites:
-                favorites_container.controls.append(create_favorite_card(city))
-        else:
-            favorites_container.controls.append(
-                ft.Container(
-                    content=ft.Text("No favorite cities yet", size=14, color=ft.Colors.GREY_500),
-                    padding=20,
-                    alignment=ft.alignment.center
-                )
-            )
-        
-        page.update()
-
-    # Main page layout
-    page.add(
-        ft.Column(
-            controls=[
-                # Header
-                ft.Container(
-                    content=ft.Row(
-                        controls=[
-                            ft.Icon(ft.Icons.WB_SUNNY, color=ft.Colors.ORANGE_400, size=32),
-                            ft.Text(
-                                "Weather Dashboard", 
-                                size=32, 
-                                weight=ft.FontWeight.BOLD, 
-                                color=ft.Colors.BLUE_800
-                            )
-                        ],
-                        alignment=ft.MainAxisAlignment.CENTER,
-                        spacing=15
-                    ), 
-                    padding=ft.padding.only(bottom=20)
-                ),
-                
-                # Search section
-                ft.Container(
-                    content=ft.Column(
-                        controls=[
-                            ft.Row(
-                                controls=[
-                                    city_input,
-                                    search_button
-                                ],
-                                spacing=15
-                            ),
-                            status_text
-                        ],
-                        spacing=10
-                    ),
-                    padding=25,
-                    bgcolor=ft.Colors.GREY_50,
-                    border_radius=15,
-                    margin=ft.margin.only(bottom=20),
-                    border=ft.border.all(1, ft.Colors.GREY_200)
-                ),
-                
-                # Main content area
-                ft.Row(
-                    controls=[
-                        # Weather and forecast section
-                        ft.Column(
-                            controls=[
-                                current_weather_card,
-                                ft.Container(
-                                    content=ft.Column(
-                                        controls=[
-                                            ft.Row(
-                                                controls=[
-                                                    ft.Icon(ft.Icons.CALENDAR_MONTH, color=ft.Colors.BLUE_600, size=24),
-                                                    ft.Text("5-Day Forecast", size=20, weight=ft.FontWeight.BOLD)
-                                                ],
-                                                spacing=10
-                                            ),
-                                            forecast_container
-                                        ],
-                                        spacing=15
-                                    ),
-                                    padding=25,
-                                    bgcolor=ft.Colors.GREY_50,
-                                    border_radius=15,
-                                    margin=ft.margin.only(top=20),
-                                    border=ft.border.all(1, ft.Colors.GREY_200)
-                                )
-                            ],
-                            expand=3
-                        ),
-                        
-                        # Favorites section
-                        ft.Container(
-                            content=favorites_container,
-                            expand=1,
-                            padding=25,
-                            bgcolor=ft.Colors.WHITE,
-                            border_radius=15,
-                            margin=ft.margin.only(left=20),
-                            border=ft.border.all(1, ft.Colors.GREY_200)
-                        )
-                    ]
-                )
-            ],
-            expand=True,
-            spacing=0
-        )
-    )
-
-    # Initialize favorites display
-    update_favorites_display()
-    
-    # Load weather for first favorite city on startup
-    if weather_app.favorites:
-        city_input.value = weather_app.favorites[0]
-        search_weather()
-
-if __name__ == "__main__":
-    ft.app(target=weatherapp, assets_dir="assets")
\ No newline at end of file
+import argparse
+import atexit
+import bisect
+import csv
+import gzip
+import importlib.util
+import json
+import datetime
+import functools
+import math
+import mmap
+import os
+import queue
+import random
+import re
+import struct
+import sys
+import threading
+import time
+import unicodedata
+from array import array
+from collections import Counter, OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+from contextlib import contextmanager, redirect_stdout
+from dataclasses import dataclass
+import zlib
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple, Union
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+def json_loads(data: Union[bytes, str]) -> Any:
+    # orjson parses the 40-point forecast several times faster when installed
+    return orjson.loads(data) if orjson is not None else json.loads(data)
+
+def json_dumps_bytes(data: Any) -> bytes:
+    return orjson.dumps(data) if orjson is not None else json.dumps(data, separators=(",", ":")).encode("utf-8")
+
+def lazy_import(name: str):
+    # The module body only runs on first attribute access, so headless
+    # runs never pay for importing the GUI stack
+    if name in sys.modules:
+        return sys.modules[name]
+    spec = importlib.util.find_spec(name)
+    if spec is None:
+        raise ImportError(f"No module named '{name}'")
+    spec.loader = importlib.util.LazyLoader(spec.loader)
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[name] = module
+    spec.loader.exec_module(module)
+    return module
+
+try:
+    ft = lazy_import("flet")
+except ImportError:
+    ft = None
+
+# Imported on the first request, well after the window is up
+requests = lazy_import("requests")
+
+@functools.lru_cache(maxsize=None)
+def optional_numpy():
+    # NumPy alone costs about as much to import as the rest of this module
+    try:
+        import numpy
+    except ImportError:
+        return None
+    return numpy
+
+@dataclass
+class CurrentConditions:
+    __slots__ = (
+        "city_id", "name", "country", "lat", "lon", "timezone", "dt", "temp", "feels_like",
+        "humidity", "pressure", "wind_speed", "description", "icon", "sunrise", "sunset"
+    )
+    city_id: int
+    name: str
+    country: str
+    lat: float
+    lon: float
+    timezone: int
+    dt: int
+    temp: float
+    feels_like: float
+    humidity: int
+    pressure: int
+    wind_speed: float
+    description: str
+    icon: str
+    sunrise: int
+    sunset: int
+
+    @classmethod
+    def from_json(cls, data: Dict) -> "CurrentConditions":
+        main = data["main"]
+        weather = data["weather"][0]
+        sys_info = data.get("sys", {})
+        coord = data.get("coord", {})
+        return cls(
+            city_id=data.get("id", 0),
+            name=data["name"],
+            country=sys_info.get("country", ""),
+            lat=coord.get("lat", 0.0),
+            lon=coord.get("lon", 0.0),
+            timezone=data.get("timezone", sys_info.get("timezone", 0)),
+            dt=data.get("dt", 0),
+            temp=main["temp"],
+            feels_like=main.get("feels_like", 0),
+            humidity=main.get("humidity", 0),
+            pressure=main["pressure"],
+            wind_speed=data.get("wind", {}).get("speed", 0),
+            description=sys.intern(weather["description"]),
+            icon=sys.intern(weather["icon"]),
+            sunrise=sys_info.get("sunrise", 0),
+            sunset=sys_info.get("sunset", 0)
+        )
+
+@dataclass
+class ForecastPoint:
+    __slots__ = ("dt", "temp", "temp_min", "temp_max", "description", "icon")
+    dt: int
+    temp: float
+    temp_min: float
+    temp_max: float
+    description: str
+    icon: str
+
+class Forecast:
+    """3-hour forecast series stored column-wise rather than as a list of dicts."""
+
+    __slots__ = ("city_id", "name", "country", "timezone", "times", "temps", "temp_mins",
+                 "temp_maxs", "wind_speeds", "precipitation", "descriptions", "icons")
+
+    def __init__(self, city_id: int, name: str, country: str, timezone: int):
+        self.city_id = city_id
+        self.name = name
+        self.country = country
+        self.timezone = timezone
+        self.times = array("q")
+        self.temps = array("f")
+        self.temp_mins = array("f")
+        self.temp_maxs = array("f")
+        self.wind_speeds = array("f")
+        # Rain plus snow over the 3 hours ending at each point, in mm
+        self.precipitation = array("f")
+        # Conditions repeat a lot across points; interned strings are shared
+        self.descriptions: List[str] = []
+        self.icons: List[str] = []
+
+    @classmethod
+    def from_json(cls, data: Dict) -> "Forecast":
+        city = data.get("city", {})
+        forecast = cls(city.get("id", 0), city.get("name", ""), city.get("country", ""), city.get("timezone", 0))
+        for item in data.get("list", []):
+            main = item["main"]
+            weather = item["weather"][0]
+            forecast.times.append(item["dt"])
+            forecast.temps.append(main["temp"])
+            forecast.temp_mins.append(main.get("temp_min", main["temp"]))
+            forecast.temp_maxs.append(main.get("temp_max", main["temp"]))
+            forecast.wind_speeds.append(item.get("wind", {}).get("speed", 0))
+            forecast.precipitation.append(item.get("rain", {}).get("3h", 0) + item.get("snow", {}).get("3h", 0))
+            forecast.descriptions.append(sys.intern(weather["description"]))
+            forecast.icons.append(sys.intern(weather["icon"]))
+        return forecast
+
+    def __len__(self) -> int:
+        return len(self.times)
+
+    def __getitem__(self, i: int) -> ForecastPoint:
+        return ForecastPoint(
+            self.times[i], self.temps[i], self.temp_mins[i], self.temp_maxs[i],
+            self.descriptions[i], self.icons[i]
+        )
+
+    def __iter__(self) -> Iterator[ForecastPoint]:
+        for i in range(len(self.times)):
+            yield self[i]
+
+@dataclass
+class DailySummary:
+    __slots__ = ("day", "temp_min", "temp_max", "temp_mean", "precipitation", "wind_max", "icon", "description")
+    # Days since the epoch in the city's local time
+    day: int
+    temp_min: float
+    temp_max: float
+    temp_mean: float
+    precipitation: float
+    wind_max: float
+    icon: str
+    description: str
+
+    @property
+    def date(self) -> datetime.date:
+        return EPOCH_DATE + datetime.timedelta(days=self.day)
+
+EPOCH_DATE = datetime.date(1970, 1, 1)
+
+def _dominant_condition(forecast: Forecast, start: int, end: int) -> Tuple[str, str]:
+    # Most frequent condition group of the day, shown with its daytime icon
+    counts = Counter(icon[:2] for icon in forecast.icons[start:end])
+    group = counts.most_common(1)[0][0]
+    for i in range(start, end):
+        if forecast.icons[i].startswith(group):
+            return group + "d", forecast.descriptions[i]
+    return forecast.icons[start], forecast.descriptions[start]
+
+# Below this many points the pure-Python pass is as fast as NumPy, so the
+# standard 40-point forecast never pays for importing it
+NUMPY_MIN_POINTS = 64
+
+def aggregate_daily(forecast: Forecast, days: int = 5) -> List[DailySummary]:
+    """Bucket the 3-hour series by the city's local day.
+
+    Day boundaries come from integer arithmetic on the timestamps plus the
+    city's UTC offset, so there is no per-point datetime work. Uses NumPy
+    for long series when it is installed and a single pure-Python pass
+    otherwise.
+    """
+    n = len(forecast)
+    if n == 0:
+        return []
+    np = optional_numpy() if n >= NUMPY_MIN_POINTS else None
+    if np is not None:
+        times = np.frombuffer(forecast.times, dtype=np.int64)
+        day_index = (times + forecast.timezone) // 86400
+        starts = np.flatnonzero(np.r_[True, day_index[1:] != day_index[:-1]])
+        ends = np.r_[starts[1:], n]
+        # reduceat folds each [start, next start) segment in one call per column
+        mins = np.minimum.reduceat(np.frombuffer(forecast.temp_mins, dtype=np.float32), starts)
+        maxs = np.maximum.reduceat(np.frombuffer(forecast.temp_maxs, dtype=np.float32), starts)
+        sums = np.add.reduceat(np.frombuffer(forecast.temps, dtype=np.float32), starts)
+        precip = np.add.reduceat(np.frombuffer(forecast.precipitation, dtype=np.float32), starts)
+        winds = np.maximum.reduceat(np.frombuffer(forecast.wind_speeds, dtype=np.float32), starts)
+        summaries = []
+        for k, (start, end) in enumerate(zip(starts[:days].tolist(), ends[:days].tolist())):
+            icon, description = _dominant_condition(forecast, start, end)
+            summaries.append(DailySummary(
+                int(day_index[start]), float(mins[k]), float(maxs[k]), float(sums[k]) / (end - start),
+                float(precip[k]), float(winds[k]), icon, description
+            ))
+        return summaries
+
+    summaries = []
+    start = 0
+    while start < n and len(summaries) < days:
+        day = (forecast.times[start] + forecast.timezone) // 86400
+        end = start
+        temp_min, temp_max = forecast.temp_mins[start], forecast.temp_maxs[start]
+        temp_sum = precipitation = wind_max = 0.0
+        while end < n and (forecast.times[end] + forecast.timezone) // 86400 == day:
+            temp_min = min(temp_min, forecast.temp_mins[end])
+            temp_max = max(temp_max, forecast.temp_maxs[end])
+            temp_sum += forecast.temps[end]
+            precipitation += forecast.precipitation[end]
+            wind_max = max(wind_max, forecast.wind_speeds[end])
+            end += 1
+        icon, description = _dominant_condition(forecast, start, end)
+        summaries.append(DailySummary(
+            day, temp_min, temp_max, temp_sum / (end - start), precipitation, wind_max, icon, description
+        ))
+        start = end
+    return summaries
+
+# Response parser per endpoint
+PARSERS = {
+    "weather": CurrentConditions.from_json,
+    "forecast": Forecast.from_json,
+}
+
+def normalize_city_name(name: str) -> str:
+    # Case-, accent- and punctuation-insensitive key for city lookups
+    decomposed = unicodedata.normalize("NFKD", name.casefold())
+    stripped = "".join(ch if ch.isalnum() else " " for ch in decomposed if not unicodedata.combining(ch))
+    return " ".join(stripped.split())
+
+@dataclass
+class CityMatch:
+    __slots__ = ("name", "country", "lat", "lon", "city_id")
+    name: str
+    country: str
+    lat: float
+    lon: float
+    # 0 when the gazetteer has no OpenWeatherMap ID for this city
+    city_id: int
+
+def _edit_distance(a: str, b: str, limit: int) -> int:
+    # Optimal string alignment distance, giving up once it exceeds limit
+    if abs(len(a) - len(b)) > limit:
+        return limit + 1
+    previous2: List[int] = []
+    previous = list(range(len(b) + 1))
+    for i, ca in enumerate(a, 1):
+        current = [i] + [0] * len(b)
+        for j, cb in enumerate(b, 1):
+            cost = 0 if ca == cb else 1
+            current[j] = min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + cost)
+            if i > 1 and j > 1 and ca == b[j - 2] and a[i - 2] == cb:
+                current[j] = min(current[j], previous2[j - 2] + 1)
+        if min(current) > limit:
+            return limit + 1
+        previous2, previous = previous, current
+    return previous[-1]
+
+EARTH_RADIUS_KM = 6371.0
+COORDINATES = re.compile(r"^\s*(-?\d{1,2}(?:\.\d+)?)\s*[,;\s]\s*(-?\d{1,3}(?:\.\d+)?)\s*$")
+
+def parse_coordinates(text: str) -> Optional[Tuple[float, float]]:
+    # "36.19, 44.01" -> (36.19, 44.01); anything else is a place name
+    match = COORDINATES.match(text)
+    if match is None:
+        return None
+    lat, lon = float(match.group(1)), float(match.group(2))
+    if not (-90 <= lat <= 90 and -180 <= lon <= 180):
+        return None
+    return lat, lon
+
+def format_coordinates(lat: float, lon: float) -> str:
+    # Four decimals is about 10 m, finer than any weather station grid
+    return f"{lat:.4f},{lon:.4f}"
+
+def haversine_km(lat1: float, lon1: float, lat2: float, lon2: float) -> float:
+    phi1, phi2 = math.radians(lat1), math.radians(lat2)
+    a = (math.sin((phi2 - phi1) / 2) ** 2
+         + math.cos(phi1) * math.cos(phi2) * math.sin(math.radians(lon2 - lon1) / 2) ** 2)
+    return 2 * EARTH_RADIUS_KM * math.asin(min(1.0, math.sqrt(a)))
+
+class SpatialIndex:
+    """Points bucketed on a lat/lon grid for nearest-within-radius lookups.
+
+    A lookup only measures the points in the handful of cells its search
+    circle overlaps, so cost stays flat as the index grows.
+    """
+
+    def __init__(self, cell_degrees: float = 0.25):
+        self.cell_degrees = cell_degrees
+        self._columns = int(round(360 / cell_degrees))
+        self._cells: Dict[Tuple[int, int], Dict[Any, Tuple[float, float, float]]] = {}
+        self._where: Dict[Any, Tuple[int, int]] = {}
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._where)
+
+    def _wrap(self, column: int) -> int:
+        # Cells either side of the antimeridian are neighbours
+        half = self._columns // 2
+        return (column + half) % self._columns - half
+
+    def _cell(self, lat: float, lon: float) -> Tuple[int, int]:
+        return math.floor(lat / self.cell_degrees), self._wrap(math.floor(lon / self.cell_degrees))
+
+    def add(self, key: Any, lat: float, lon: float, stamp: float = 0.0):
+        cell = self._cell(lat, lon)
+        with self._lock:
+            previous = self._where.get(key)
+            if previous is not None and previous != cell:
+                self._discard(key, previous)
+            self._cells.setdefault(cell, {})[key] = (lat, lon, stamp)
+            self._where[key] = cell
+
+    def remove(self, key: Any):
+        with self._lock:
+            cell = self._where.pop(key, None)
+            if cell is not None:
+                self._discard(key, cell)
+
+    def _discard(self, key: Any, cell: Tuple[int, int]):
+        points = self._cells.get(cell, {})
+        points.pop(key, None)
+        if not points:
+            self._cells.pop(cell, None)
+
+    def nearest(self, lat: float, lon: float, radius_km: float, since: Optional[float] = None,
+                accept: Optional[Callable[[Any], bool]] = None) -> Optional[Tuple[Any, float]]:
+        # (key, distance in km) of the closest point stamped at or after `since`
+        rows = math.ceil(radius_km / 111.2 / self.cell_degrees)
+        # A degree of longitude shrinks towards the poles
+        width = 111.2 * max(math.cos(math.radians(lat)), 0.01)
+        columns = min(math.ceil(radius_km / width / self.cell_degrees), self._columns // 2)
+        row, column = self._cell(lat, lon)
+        candidates = []
+        with self._lock:
+            for y in range(row - rows, row + rows + 1):
+                for x in range(column - columns, column + columns + 1):
+                    for key, (point_lat, point_lon, stamp) in self._cells.get((y, self._wrap(x)), {}).items():
+                        if since is not None and stamp < since:
+                            continue
+                        distance = haversine_km(lat, lon, point_lat, point_lon)
+                        if distance <= radius_km:
+                            candidates.append((distance, key))
+        # accept may be slow (a shared cache lookup), so it runs without the
+        # lock, closest first, and stops at the first point it takes
+        candidates.sort(key=lambda candidate: candidate[0])
+        for distance, key in candidates:
+            if accept is None or accept(key):
+                return key, distance
+        return None
+
+class CityIndex:
+    """Offline gazetteer with prefix and fuzzy lookup.
+
+    The source is either the bundled cities.csv or OpenWeatherMap's
+    city.list.json(.gz). On first use it is compiled into a sorted binary
+    index next to the source, which later runs memory-map instead of
+    parsing, so startup cost does not grow with the gazetteer.
+
+    Typo lookups use a symmetric deletion index: every distinct key prefix
+    of DELETE_MIN to DELETE_WINDOW letters is stored together with each of
+    its one-letter deletions, hashed and sorted. Two prefixes one edit
+    apart always share one of those strings, so a typo costs a few binary
+    searches, however many cities the gazetteer holds.
+    """
+
+    MAGIC = b"WXCIDX02"
+    # magic, record count, deletion count
+    HEADER = struct.Struct("<8sII")
+    # key offset, key length, name offset, name length, country, lat, lon, city id
+    RECORD = struct.Struct("<IHIH2sffI")
+    # crc32 of the prefix or deletion, first record with the prefix, prefix length
+    DELETION = struct.Struct("<IIB")
+    DELETE_MIN = 3
+    DELETE_WINDOW = 6
+    # Most candidate keys a typo lookup compares, and most binary searches
+    # it spends following corrections, however many keys look alike
+    FUZZY_VERIFY_LIMIT = 200
+    FUZZY_PROBE_LIMIT = 300
+
+    def __init__(self, source_path: str, index_path: Optional[str] = None):
+        self.source_path = source_path
+        self.index_path = index_path or os.path.splitext(source_path.replace(".gz", ""))[0] + ".idx"
+        self._lock = threading.Lock()
+        self._mmap: Optional[mmap.mmap] = None
+        self._count = 0
+        self._deletions_offset = 0
+        self._deletion_count = 0
+        self._strings_offset = 0
+        self._grid: Optional[SpatialIndex] = None
+        self._grid_building = False
+        self._grid_lock = threading.Lock()
+
+    def _open(self) -> mmap.mmap:
+        if self._mmap is not None:
+            return self._mmap
+        with self._lock:
+            if self._mmap is None:
+                if not os.path.exists(self.index_path) or (
+                        os.path.exists(self.source_path)
+                        and os.path.getmtime(self.source_path) > os.path.getmtime(self.index_path)):
+                    self.build(self.source_path, self.index_path)
+                data = self._map()
+                if data[:6] == self.MAGIC[:6] and data[:8] != self.MAGIC and os.path.exists(self.source_path):
+                    # Written by an older version; rebuild it in the current format
+                    data.close()
+                    self.build(self.source_path, self.index_path)
+                    data = self._map()
+                magic, count, deletion_count = self.HEADER.unpack_from(data, 0)
+                if magic != self.MAGIC:
+                    raise ValueError(f"{self.index_path} is not a city index")
+                self._count = count
+                self._deletions_offset = self.HEADER.size + count * self.RECORD.size
+                self._deletion_count = deletion_count
+                self._strings_offset = self._deletions_offset + deletion_count * self.DELETION.size
+                self._mmap = data
+        return self._mmap
+
+    def _map(self) -> mmap.mmap:
+        with open(self.index_path, "rb") as f:
+            return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+    @staticmethod
+    def _variants(prefix: str) -> Iterator[str]:
+        # The prefix itself and every string one deletion away from it
+        yield prefix
+        for i in range(len(prefix)):
+            yield prefix[:i] + prefix[i + 1:]
+
+    @staticmethod
+    def _hash(text: str) -> int:
+        return zlib.crc32(text.encode("utf-8"))
+
+    @classmethod
+    def _read_source(cls, source_path: str) -> Iterator[Tuple[str, str, str, float, float, int]]:
+        # Yields (search key, display name, country, lat, lon, city id)
+        if source_path.endswith((".json", ".json.gz")):
+            opener = gzip.open if source_path.endswith(".gz") else open
+            with opener(source_path, "rt", encoding="utf-8") as f:
+                for city in json.load(f):
+                    coord = city.get("coord", {})
+                    yield (normalize_city_name(city["name"]), city["name"], city.get("country", ""),
+                           coord.get("lat", 0.0), coord.get("lon", 0.0), city.get("id", 0))
+            return
+        with open(source_path, "r", encoding="utf-8", newline="") as f:
+            for row in csv.DictReader(f):
+                lat, lon, city_id = float(row["lat"]), float(row["lon"]), int(row["id"] or 0)
+                for alias in [row["name"]] + [a for a in (row.get("aliases") or "").split("|") if a]:
+                    yield normalize_city_name(alias), row["name"], row["country"], lat, lon, city_id
+
+    @classmethod
+    def build(cls, source_path: str, index_path: str):
+        entries = sorted(set(cls._read_source(source_path)), key=lambda entry: (entry[0], entry[2], entry[1]))
+        strings = bytearray()
+        offsets: Dict[str, Tuple[int, int]] = {}
+
+        def intern(text: str) -> Tuple[int, int]:
+            if text not in offsets:
+                encoded = text.encode("utf-8")
+                offsets[text] = (len(strings), len(encoded))
+                strings.extend(encoded)
+            return offsets[text]
+
+        records = bytearray()
+        deletions = set()
+        seen_prefixes = set()
+        for i, (key, name, country, lat, lon, city_id) in enumerate(entries):
+            key_offset, key_length = intern(key)
+            name_offset, name_length = intern(name)
+            records.extend(cls.RECORD.pack(
+                key_offset, key_length, name_offset, name_length,
+                country.encode("ascii", "replace")[:2].ljust(2), lat, lon, city_id
+            ))
+            # Keys are sorted, so i is the first record of every prefix seen here first
+            for length in range(cls.DELETE_MIN, min(len(key), cls.DELETE_WINDOW) + 1):
+                prefix = key[:length]
+                if prefix not in seen_prefixes:
+                    seen_prefixes.add(prefix)
+                    deletions.update((cls._hash(variant), i, length) for variant in cls._variants(prefix))
+        # Write next to the final path and rename, so readers never see a partial index
+        tmp_path = f"{index_path}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(cls.HEADER.pack(cls.MAGIC, len(entries), len(deletions)))
+            f.write(records)
+            f.write(b"".join(cls.DELETION.pack(*deletion) for deletion in sorted(deletions)))
+            f.write(strings)
+        os.replace(tmp_path, index_path)
+
+    def __len__(self) -> int:
+        self._open()
+        return self._count
+
+    def _string(self, data: mmap.mmap, offset: int, length: int) -> str:
+        start = self._strings_offset + offset
+        return data[start:start + length].decode("utf-8")
+
+    def _key(self, data: mmap.mmap, i: int) -> str:
+        key_offset, key_length = struct.unpack_from("<IH", data, self.HEADER.size + i * self.RECORD.size)
+        return self._string(data, key_offset, key_length)
+
+    def _match(self, data: mmap.mmap, i: int) -> CityMatch:
+        _, _, name_offset, name_length, country, lat, lon, city_id = self.RECORD.unpack_from(
+            data, self.HEADER.size + i * self.RECORD.size
+        )
+        return CityMatch(self._string(data, name_offset, name_length), country.decode("ascii").strip(),
+                         round(lat, 4), round(lon, 4), city_id)
+
+    def _lower_bound(self, data: mmap.mmap, key: str, low: int = 0, high: Optional[int] = None) -> int:
+        if high is None:
+            high = self._count
+        while low < high:
+            middle = (low + high) // 2
+            if self._key(data, middle) < key:
+                low = middle + 1
+            else:
+                high = middle
+        return low
+
+    def lookup(self, name: str) -> Optional[CityMatch]:
+        # Exact match on the name or one of its aliases
+        key = normalize_city_name(name)
+        if not key:
+            return None
+        data = self._open()
+        i = self._lower_bound(data, key)
+        if i < self._count and self._key(data, i) == key:
+            return self._match(data, i)
+        return None
+
+    def nearest(self, lat: float, lon: float, radius_km: float) -> Optional[CityMatch]:
+        # The grid is built on the first coordinate lookup, not at startup, and
+        # in the background: until it is ready there is simply no match, and the
+        # caller fetches by coordinates as it would for a point far from any city
+        data = self._open()
+        grid = self._grid
+        if grid is None:
+            with self._grid_lock:
+                if not self._grid_building:
+                    self._grid_building = True
+                    threading.Thread(target=self._build_grid, args=(data,), name="city-grid", daemon=True).start()
+            return None
+        hit = grid.nearest(lat, lon, radius_km)
+        return self._match(data, hit[0]) if hit is not None else None
+
+    def _build_grid(self, data: mmap.mmap):
+        grid = SpatialIndex()
+        seen = set()
+        records = memoryview(data)[self.HEADER.size:self._deletions_offset]
+        try:
+            for i, (_, _, name_offset, _, country, lat, lon, _) in enumerate(self.RECORD.iter_unpack(records)):
+                # Aliases repeat the same place; index it once
+                if (name_offset, country) not in seen:
+                    seen.add((name_offset, country))
+                    grid.add(i, lat, lon)
+        finally:
+            records.release()
+        self._grid = grid
+
+    def _deletion_matches(self, data: mmap.mmap, window: str) -> set:
+        # (first record, prefix length) of every indexed prefix sharing a deletion with window
+        groups = set()
+        for variant in set(self._variants(window)):
+            target = self._hash(variant)
+            low, high = 0, self._deletion_count
+            while low < high:
+                middle = (low + high) // 2
+                if struct.unpack_from("<I", data, self._deletions_offset + middle * self.DELETION.size)[0] < target:
+                    low = middle + 1
+                else:
+                    high = middle
+            while low < self._deletion_count:
+                digest, start, length = self.DELETION.unpack_from(data, self._deletions_offset + low * self.DELETION.size)
+                if digest != target:
+                    break
+                groups.add((start, length))
+                low += 1
+        return groups
+
+    def suggest(self, text: str, limit: int = 8) -> List[CityMatch]:
+        key = normalize_city_name(text)
+        if not key:
+            return []
+        data = self._open()
+        matches: List[CityMatch] = []
+        seen = set()
+
+        def add(i: int):
+            match = self._match(data, i)
+            if (match.name, match.country) not in seen:
+                seen.add((match.name, match.country))
+                matches.append(match)
+
+        i = self._lower_bound(data, key)
+        while i < self._count and len(matches) < limit and self._key(data, i).startswith(key):
+            add(i)
+            i += 1
+        if matches or len(key) < 3:
+            return matches
+
+        # Nothing starts with what was typed, so it is probably a typo. An edit
+        # among the first letters shows up as a shared deletion; past them, or
+        # for a second edit when the input is long enough to afford one, the
+        # keys are followed letter by letter from where they stop matching.
+        budget = 1 if len(key) < 6 else 2
+        windows = [key[:self.DELETE_WINDOW]]
+        if len(key) >= self.DELETE_WINDOW:
+            # A letter missing from the window moves the last one past it
+            windows.append(key[:self.DELETE_WINDOW - 1])
+        groups = set()
+        for window in windows:
+            for start, length in self._deletion_matches(data, window):
+                prefix = self._key(data, start)[:length]
+                groups.add((0 if prefix == window else 1, prefix, len(window), start))
+        scored = []
+        checked = 0
+        probes = 0
+        # Records of the group being searched; every correction stays inside it
+        low = high = 0
+
+        def has_prefix(prefix: str) -> bool:
+            nonlocal probes
+            probes += 1
+            i = self._lower_bound(data, prefix, low, high)
+            return i < high and self._key(data, i).startswith(prefix)
+
+        def next_letters(prefix: str) -> Iterator[str]:
+            nonlocal probes
+            i = self._lower_bound(data, prefix, low, high)
+            while i < high and probes < self.FUZZY_PROBE_LIMIT:
+                candidate = self._key(data, i)
+                if not candidate.startswith(prefix):
+                    return
+                if len(candidate) == len(prefix):
+                    i += 1
+                    continue
+                letter = candidate[len(prefix)]
+                yield letter
+                probes += 1
+                i = self._lower_bound(data, prefix + chr(ord(letter) + 1), i, high)
+
+        def corrections(stem: str, rest: str, edits: int) -> Iterator[str]:
+            # Key prefixes spelling stem + rest with at most edits edits to rest
+            shortest, longest = 0, len(rest)
+            while shortest < longest:
+                middle = (shortest + longest + 1) // 2
+                if has_prefix(stem + rest[:middle]):
+                    shortest = middle
+                else:
+                    longest = middle - 1
+            if shortest == len(rest):
+                yield stem + rest
+                return
+            if edits == 0 or probes >= self.FUZZY_PROBE_LIMIT:
+                return
+            stem, rest = stem + rest[:shortest], rest[shortest:]
+            yield from corrections(stem, rest[1:], edits - 1)
+            if len(rest) > 1:
+                yield from corrections(stem, rest[1] + rest[0] + rest[2:], edits - 1)
+            for letter in next_letters(stem):
+                yield from corrections(stem + letter, rest[1:], edits - 1)
+                yield from corrections(stem + letter, rest, edits - 1)
+
+        # A single typo is by far the likeliest; only look for two when there is none
+        for allowed in range(1, budget + 1):
+            # Exact windows first, then the longest prefixes: the closest and smallest groups
+            for edits, prefix, consumed, low in sorted(groups, key=lambda group: (group[0], -len(group[1]), group[1])):
+                if checked >= self.FUZZY_VERIFY_LIMIT or probes >= self.FUZZY_PROBE_LIMIT:
+                    break
+                high = self._lower_bound(data, prefix[:-1] + chr(ord(prefix[-1]) + 1), low)
+                for stem in corrections(prefix, key[consumed:], allowed - edits):
+                    first = self._lower_bound(data, stem, low, high)
+                    for i in range(first, min(first + limit, high)):
+                        candidate = self._key(data, i)
+                        if not candidate.startswith(stem):
+                            break
+                        distance = _edit_distance(key, candidate[:len(key) + budget], budget)
+                        if distance <= budget:
+                            scored.append((distance, len(candidate), i))
+                        checked += 1
+            if scored:
+                break
+        for _, _, i in sorted(set(scored)):
+            if len(matches) >= limit:
+                break
+            add(i)
+        return matches
+
+class TTLCache:
+    def __init__(self, max_entries: int = 256):
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[Tuple, Tuple[float, Any]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key: Tuple) -> Optional[Any]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            expires_at, value = entry
+            if expires_at <= time.monotonic():
+                # Expired entries stay until evicted; stale() may still serve them
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def peek(self, key: Tuple) -> Optional[Any]:
+        # Like get(), but leaves the counters and LRU order alone
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[0] <= time.monotonic():
+                return None
+            return entry[1]
+
+    def stale(self, key: Tuple) -> Optional[Any]:
+        # Last value stored under the key, expired or not
+        with self._lock:
+            entry = self._entries.get(key)
+            return entry[1] if entry is not None else None
+
+    def set(self, key: Tuple, value: Any, ttl: float, payload: Optional[Dict] = None):
+        # payload is the raw response behind value; only a shared cache needs it
+        with self._lock:
+            self._entries[key] = (time.monotonic() + ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {
+                "size": len(self._entries),
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+            }
+
+class RedisCache:
+    """TTLCache stand-in backed by Redis, shared by every server process.
+
+    Entries are the raw JSON payloads stamped with their wall-clock expiry,
+    parsed again on the way out like WeatherStore's: anything that can
+    write to a shared Redis could run code through a pickle. Redis keeps
+    them for a day past the expiry, so stale() can still serve them when
+    the request budget runs out.
+    """
+
+    def __init__(self, url: str, prefix: str = "weather:", stale_for: float = 86400):
+        import redis
+        self._redis = redis
+        self._client = redis.Redis.from_url(url)
+        self.prefix = prefix
+        self.stale_for = stale_for
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def _key(self, key: Tuple) -> str:
+        return self.prefix + ":".join(str(part) for part in key)
+
+    def _read(self, key: Tuple) -> Optional[Dict]:
+        try:
+            raw = self._client.get(self._key(key))
+            return json_loads(raw) if raw is not None else None
+        except self._redis.RedisError as e:
+            print(f"Error reading shared cache: {e}")
+        except ValueError as e:
+            print(f"Error decoding shared cache entry: {e}")
+        return None
+
+    def _write(self, key: Tuple, entry: Dict, ttl: float):
+        try:
+            self._client.set(self._key(key), json_dumps_bytes(entry), ex=int(max(ttl, 0) + self.stale_for))
+        except self._redis.RedisError as e:
+            print(f"Error writing shared cache: {e}")
+
+    def _load(self, key: Tuple) -> Optional[Tuple[float, Any]]:
+        entry = self._read(key)
+        if entry is None:
+            return None
+        try:
+            return entry["expires"], PARSERS[key[0]](entry["payload"])
+        except (KeyError, IndexError, TypeError) as e:
+            print(f"Error parsing shared cache entry: {e}")
+            return None
+
+    def get(self, key: Tuple) -> Optional[Any]:
+        entry = self._load(key)
+        if entry is None or entry[0] <= time.time():
+            self.misses += 1
+            return None
+        self.hits += 1
+        return entry[1]
+
+    def peek(self, key: Tuple) -> Optional[Any]:
+        entry = self._load(key)
+        return entry[1] if entry is not None and entry[0] > time.time() else None
+
+    def stale(self, key: Tuple) -> Optional[Any]:
+        entry = self._load(key)
+        return entry[1] if entry is not None else None
+
+    def set(self, key: Tuple, value: Any, ttl: float, payload: Optional[Dict] = None):
+        if payload is None:
+            # Revalidated or restored data: restamp the entry already shared, if any
+            entry = self._read(key)
+            payload = entry.get("payload") if isinstance(entry, dict) else None
+            if payload is None:
+                return
+        self._write(key, {"expires": time.time() + ttl, "payload": payload}, ttl)
+
+    def clear(self):
+        try:
+            keys = list(self._client.scan_iter(match=f"{self.prefix}*"))
+            if keys:
+                self._client.delete(*keys)
+        except self._redis.RedisError as e:
+            print(f"Error clearing shared cache: {e}")
+
+    def stats(self) -> Dict[str, int]:
+        return {"size": -1, "hits": self.hits, "misses": self.misses, "evictions": self.evictions}
+
+def make_cache(max_entries: int = 256) -> Union[TTLCache, RedisCache]:
+    # Redis when configured and importable, otherwise the in-process cache
+    url = os.environ.get("WEATHER_REDIS_URL")
+    if url:
+        try:
+            return RedisCache(url)
+        except ImportError:
+            print("WEATHER_REDIS_URL is set but the redis package is not installed; using the local cache")
+    return TTLCache(max_entries=max_entries)
+
+class WeatherStore:
+    """Last /weather and /forecast payload per city, kept across sessions."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        import sqlite3
+
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        # WAL keeps each write atomic without an fsync per commit on the fetch path
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        with self._conn:
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS payloads ("
+                " endpoint TEXT NOT NULL, city TEXT NOT NULL, units TEXT NOT NULL,"
+                " fetched_at REAL NOT NULL, payload BLOB NOT NULL,"
+                " PRIMARY KEY (endpoint, city, units)) WITHOUT ROWID"
+            )
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS city_ids ("
+                " city TEXT PRIMARY KEY, city_id INTEGER NOT NULL) WITHOUT ROWID"
+            )
+
+    @classmethod
+    def open(cls, path: str) -> Optional["WeatherStore"]:
+        # The store is only a cache: a read-only directory or a locked or
+        # damaged file means running without it, not failing to start
+        try:
+            return cls(path)
+        except Exception as e:
+            print(f"Error opening weather store {path}: {e}")
+            return None
+
+    def get(self, key: Tuple[str, str, str]) -> Optional[Tuple[float, Dict]]:
+        try:
+            with self._lock:
+                row = self._conn.execute(
+                    "SELECT fetched_at, payload FROM payloads WHERE endpoint = ? AND city = ? AND units = ?",
+                    key
+                ).fetchone()
+            if row is None:
+                return None
+            return row[0], json_loads(zlib.decompress(row[1]))
+        except Exception as e:
+            print(f"Error reading weather store: {e}")
+            return None
+
+    def put(self, key: Tuple[str, str, str], payload: Dict, fetched_at: Optional[float] = None):
+        blob = zlib.compress(json_dumps_bytes(payload))
+        try:
+            # Each write is its own transaction, so a crash never leaves a torn row
+            with self._lock, self._conn:
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO payloads VALUES (?, ?, ?, ?, ?)",
+                    (*key, fetched_at or time.time(), blob)
+                )
+        except Exception as e:
+            print(f"Error writing weather store: {e}")
+
+    def touch(self, key: Tuple[str, str, str], fetched_at: Optional[float] = None):
+        # Upstream confirmed the saved payload is still current
+        try:
+            with self._lock, self._conn:
+                self._conn.execute(
+                    "UPDATE payloads SET fetched_at = ? WHERE endpoint = ? AND city = ? AND units = ?",
+                    (fetched_at or time.time(), *key)
+                )
+        except Exception as e:
+            print(f"Error writing weather store: {e}")
+
+    def get_city_ids(self) -> Dict[str, int]:
+        try:
+            with self._lock:
+                return dict(self._conn.execute("SELECT city, city_id FROM city_ids"))
+        except Exception as e:
+            print(f"Error reading weather store: {e}")
+            return {}
+
+    def put_city_id(self, city: str, city_id: int):
+        try:
+            with self._lock, self._conn:
+                self._conn.execute("INSERT OR REPLACE INTO city_ids VALUES (?, ?)", (city, city_id))
+        except Exception as e:
+            print(f"Error writing weather store: {e}")
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+@dataclass
+class HistoryPoint:
+    __slots__ = ("dt", "temp", "temp_min", "temp_max", "humidity", "pressure", "wind_max")
+    dt: int
+    temp: float
+    temp_min: float
+    temp_max: float
+    humidity: float
+    pressure: float
+    wind_max: float
+
+class HistoryStore:
+    """Append-only observation history per city, for trend charts.
+
+    One narrow row per observation, clustered by (city, dt) in a WITHOUT
+    ROWID table, so a range query is a single contiguous index scan.
+    Values are stored as scaled integers (hundredths of a degree, of a
+    m/s), which SQLite packs into 1-3 bytes each. Range queries are
+    downsampled in SQL, so months of data never reach Python row by row.
+    """
+
+    SCALE = 100
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        import sqlite3
+
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        with self._conn:
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS observations ("
+                " city TEXT NOT NULL, dt INTEGER NOT NULL, temp INTEGER NOT NULL,"
+                " humidity INTEGER NOT NULL, pressure INTEGER NOT NULL, wind INTEGER NOT NULL,"
+                " PRIMARY KEY (city, dt)) WITHOUT ROWID"
+            )
+
+    @classmethod
+    def open(cls, path: str) -> Optional["HistoryStore"]:
+        # Without it the trend chart stays empty; everything else still works
+        try:
+            return cls(path)
+        except Exception as e:
+            print(f"Error opening history store {path}: {e}")
+            return None
+
+    def record(self, city: str, conditions: CurrentConditions):
+        self.record_many([(city, conditions)])
+
+    def record_many(self, observations: List[Tuple[str, CurrentConditions]]):
+        # A refresh that lands on the same observation time is ignored, not duplicated
+        rows = [
+            (city, c.dt, round(c.temp * self.SCALE), c.humidity, c.pressure, round(c.wind_speed * self.SCALE))
+            for city, c in observations if c.dt
+        ]
+        try:
+            with self._lock, self._conn:
+                self._conn.executemany("INSERT OR IGNORE INTO observations VALUES (?, ?, ?, ?, ?, ?)", rows)
+        except Exception as e:
+            print(f"Error writing history: {e}")
+
+    def query(self, city: str, start: int, end: int, buckets: int = 120) -> List[HistoryPoint]:
+        # At most `buckets` points between start and end, each averaging its slice of time
+        width = max(1, -(-(end - start) // buckets))
+        scale = float(self.SCALE)
+        try:
+            with self._lock:
+                rows = self._conn.execute(
+                    "SELECT AVG(dt), AVG(temp), MIN(temp), MAX(temp), AVG(humidity), AVG(pressure), MAX(wind)"
+                    " FROM observations WHERE city = ? AND dt BETWEEN ? AND ?"
+                    " GROUP BY (dt - ?) / ? ORDER BY 1",
+                    (city, start, end, start, width)
+                ).fetchall()
+        except Exception as e:
+            print(f"Error reading history: {e}")
+            return []
+        return [
+            HistoryPoint(int(dt), temp / scale, temp_min / scale, temp_max / scale, humidity, pressure, wind / scale)
+            for dt, temp, temp_min, temp_max, humidity, pressure, wind in rows
+        ]
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+class Histogram:
+    """Fixed-bucket histogram; cheap enough to sit on every hot path."""
+
+    def __init__(self, buckets: Tuple[float, ...]):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.last = 0.0
+
+    def observe(self, value: float):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+        self.last = value
+
+    def quantile(self, q: float) -> float:
+        # Upper bound of the bucket holding the q-th observation
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        for bound, count in zip(self.buckets, self.counts):
+            seen += count
+            if seen >= rank:
+                return bound
+        return float("inf")
+
+class Metrics:
+    """In-memory timings for fetch, parse, UI build and page updates.
+
+    Durations are recorded in milliseconds under names ending in _ms, sizes
+    in bytes under names ending in _bytes. Optionally every observation is
+    also appended to a JSONL file, and the histograms can be served in the
+    Prometheus text format.
+    """
+
+    MS_BUCKETS = (0.1, 0.5, 1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000, 10000)
+    BYTES_BUCKETS = (512, 1024, 2048, 4096, 8192, 16384, 32768, 65536, 131072, 262144)
+
+    def __init__(self, jsonl_path: Optional[str] = None):
+        self.jsonl_path = jsonl_path
+        self._histograms: Dict[str, Histogram] = {}
+        self._counters: Dict[Tuple[str, Tuple[Tuple[str, str], ...]], int] = {}
+        self._lock = threading.Lock()
+        # Observations waiting for the JSONL writer thread, started on first use
+        self._records: Optional["queue.SimpleQueue"] = None
+        self._writer: Optional[threading.Thread] = None
+
+    def observe(self, name: str, value: float, **fields):
+        with self._lock:
+            histogram = self._histograms.get(name)
+            if histogram is None:
+                buckets = self.BYTES_BUCKETS if name.endswith("_bytes") else self.MS_BUCKETS
+                histogram = self._histograms[name] = Histogram(buckets)
+            histogram.observe(value)
+            if self.jsonl_path and self._records is None:
+                self._records = queue.SimpleQueue()
+                self._writer = threading.Thread(target=self._write_records, name="metrics-jsonl", daemon=True)
+                self._writer.start()
+                atexit.register(self._close_records)
+        # The file is written on another thread, so fetch threads never wait on the disk
+        if self._records is not None:
+            self._records.put({"ts": round(time.time(), 3), "metric": name, "value": round(value, 3), **fields})
+
+    def _write_records(self):
+        try:
+            f = open(self.jsonl_path, "a")
+        except OSError as e:
+            print(f"Error writing metrics: {e}")
+            return
+        with f:
+            while True:
+                record = self._records.get()
+                if record is None:
+                    return
+                try:
+                    f.write(json.dumps(record) + "\n")
+                    # One handle, flushed whenever the writer has caught up
+                    if self._records.empty():
+                        f.flush()
+                except OSError as e:
+                    print(f"Error writing metrics: {e}")
+
+    def _close_records(self):
+        # Let the writer drain what was recorded before the interpreter exits
+        self._records.put(None)
+        self._writer.join(timeout=2)
+
+    def increment(self, name: str, **labels):
+        key = (name, tuple(sorted((k, str(v)) for k, v in labels.items())))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + 1
+
+    @contextmanager
+    def timer(self, name: str, **fields):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, (time.perf_counter() - start) * 1000, **fields)
+
+    def latest(self) -> Dict[str, float]:
+        with self._lock:
+            return {name: histogram.last for name, histogram in sorted(self._histograms.items())}
+
+    def summary(self) -> Dict[str, Dict[str, float]]:
+        with self._lock:
+            return {
+                name: {
+                    "count": histogram.count,
+                    "mean": histogram.sum / histogram.count if histogram.count else 0.0,
+                    "p50": histogram.quantile(0.5),
+                    "p99": histogram.quantile(0.99),
+                    "last": histogram.last,
+                }
+                for name, histogram in sorted(self._histograms.items())
+            }
+
+    def prometheus_text(self) -> str:
+        lines = []
+        with self._lock:
+            for name, histogram in sorted(self._histograms.items()):
+                metric = f"weather_{name}"
+                lines.append(f"# TYPE {metric} histogram")
+                cumulative = 0
+                for bound, count in zip(histogram.buckets, histogram.counts):
+                    cumulative += count
+                    lines.append(f'{metric}_bucket{{le="{bound}"}} {cumulative}')
+                lines.append(f'{metric}_bucket{{le="+Inf"}} {histogram.count}')
+                lines.append(f"{metric}_sum {histogram.sum}")
+                lines.append(f"{metric}_count {histogram.count}")
+            typed = set()
+            for (name, labels), value in sorted(self._counters.items()):
+                if name not in typed:
+                    lines.append(f"# TYPE weather_{name} counter")
+                    typed.add(name)
+                label_text = ",".join(f'{k}="{v}"' for k, v in labels)
+                lines.append(f"weather_{name}{{{label_text}}} {value}")
+        return "\n".join(lines) + "\n"
+
+    def serve_prometheus(self, port: int, host: str = "127.0.0.1") -> "ThreadingHTTPServer":
+        from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+        metrics = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.rstrip("/") != "/metrics":
+                    self.send_error(404)
+                    return
+                body = metrics.prometheus_text().encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        server = ThreadingHTTPServer((host, port), Handler)
+        threading.Thread(target=server.serve_forever, name="metrics-http", daemon=True).start()
+        return server
+
+# Process-wide metrics; WEATHER_METRICS_JSONL / WEATHER_METRICS_PORT turn on export
+metrics = Metrics(jsonl_path=os.environ.get("WEATHER_METRICS_JSONL"))
+
+@functools.lru_cache(maxsize=None)
+def http_classes() -> Tuple[type, type]:
+    """Build the instrumented transport adapter and retry policy on first use.
+
+    They subclass requests and urllib3 types, so defining them at module
+    level would import the whole HTTP stack before the window can open.
+    """
+    from requests.adapters import HTTPAdapter
+    from urllib3.connection import HTTPConnection, HTTPSConnection
+    from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+    from urllib3.util.retry import Retry
+
+    class TimedHTTPConnection(HTTPConnection):
+        # DNS lookup plus TCP connect for each new pooled connection
+        def _new_conn(self):
+            with metrics.timer("upstream_connect_ms", host=self.host):
+                return super()._new_conn()
+
+    class TimedHTTPSConnection(HTTPSConnection):
+        def _new_conn(self):
+            with metrics.timer("upstream_connect_ms", host=self.host):
+                return super()._new_conn()
+
+    class TimedHTTPConnectionPool(HTTPConnectionPool):
+        ConnectionCls = TimedHTTPConnection
+
+    class TimedHTTPSConnectionPool(HTTPSConnectionPool):
+        ConnectionCls = TimedHTTPSConnection
+
+    class TimedHTTPAdapter(HTTPAdapter):
+        def init_poolmanager(self, *args, **kwargs):
+            super().init_poolmanager(*args, **kwargs)
+            self.poolmanager.pool_classes_by_scheme = {
+                "http": TimedHTTPConnectionPool,
+                "https": TimedHTTPSConnectionPool,
+            }
+
+    class BoundedRetry(Retry):
+        # Cap how long a Retry-After header can make us sleep, so even a
+        # throttled call keeps a hard upper bound on its latency
+        max_retry_after = 10.0
+        # urllib3 retries these whenever Retry-After is present, forcelist or
+        # not; a 429 has to reach the request budget on the first try
+        RETRY_AFTER_STATUS_CODES = frozenset({413, 503})
+
+        def get_retry_after(self, response):
+            retry_after = super().get_retry_after(response)
+            if retry_after is None:
+                return None
+            return min(retry_after, self.max_retry_after)
+
+    return TimedHTTPAdapter, BoundedRetry
+
+class RequestBudget:
+    """Token bucket shared by every upstream call, sized to the API plan.
+
+    Interactive requests may spend every token and wait for the next one;
+    background refreshes leave a reserve untouched and give way while a
+    search is waiting. A 429 empties the bucket until the server's
+    Retry-After has passed.
+    """
+
+    INTERACTIVE = 0
+    BACKGROUND = 1
+    # Back-off after a 429 that carries no Retry-After header
+    DEFAULT_RETRY_AFTER = 10.0
+
+    def __init__(self, calls_per_minute: float = 60, burst: Optional[float] = None, reserve: float = 0.2):
+        self.rate = calls_per_minute / 60.0
+        self.capacity = burst if burst is not None else max(1.0, calls_per_minute / 4)
+        self.reserve = self.capacity * reserve
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._blocked_until = 0.0
+        self._waiting_interactive = 0
+        self._cond = threading.Condition()
+
+    def _refill(self, now: float):
+        if now > self._blocked_until:
+            elapsed = now - max(self._updated, self._blocked_until)
+            self._tokens = min(self.capacity, self._tokens + elapsed * self.rate)
+        self._updated = now
+
+    def acquire(self, priority: int = INTERACTIVE, timeout: Optional[float] = None) -> bool:
+        interactive = priority == self.INTERACTIVE
+        floor = 1.0 if interactive else 1.0 + self.reserve
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._cond:
+            if interactive:
+                self._waiting_interactive += 1
+            try:
+                while True:
+                    now = time.monotonic()
+                    self._refill(now)
+                    if self._tokens >= floor and (interactive or not self._waiting_interactive):
+                        self._tokens -= 1
+                        return True
+                    wait = max(self._blocked_until - now, (floor - self._tokens) / self.rate, 0.001)
+                    if deadline is not None:
+                        if now >= deadline:
+                            return False
+                        wait = min(wait, deadline - now)
+                    self._cond.wait(wait)
+            finally:
+                if interactive:
+                    self._waiting_interactive -= 1
+                    self._cond.notify_all()
+
+    def penalize(self, retry_after: Optional[float] = None):
+        with self._cond:
+            now = time.monotonic()
+            self._tokens = 0.0
+            self._updated = now
+            self._blocked_until = max(self._blocked_until, now + (retry_after or self.DEFAULT_RETRY_AFTER))
+
+    def wait_time(self) -> float:
+        # Seconds until an interactive call could go out
+        with self._cond:
+            now = time.monotonic()
+            self._refill(now)
+            return max(0.0, self._blocked_until - now, (1.0 - self._tokens) / self.rate)
+
+class WeatherAPI:
+    # The /group endpoint accepts at most this many city IDs per call
+    GROUP_LIMIT = 20
+    # /forecast returns 5 days of 3-hour steps unless cnt asks for fewer
+    FORECAST_POINTS = 40
+
+    DEFAULT_BASE_URL = "http://api.openweathermap.org/data/2.5"
+    DEFAULT_GEO_URL = "http://api.openweathermap.org/geo/1.0"
+    DEFAULT_API_KEY = "7f8aeed7e99abbbb6ec7b12c630cb84d"
+
+    def __init__(self, current_ttl: float = 300, forecast_ttl: float = 1800, cache_size: int = 256,
+                 store: Optional[WeatherStore] = None, connect_timeout: float = 3.05,
+                 read_timeout: float = 10, max_retries: int = 3, backoff_factor: float = 0.5,
+                 pool_size: int = 10, base_url: Optional[str] = None, api_key: Optional[str] = None,
+                 city_index: Optional[CityIndex] = None, calls_per_minute: Optional[float] = None,
+                 max_wait: Optional[float] = 5.0, cache: Optional[Union[TTLCache, RedisCache]] = None,
+                 geo_url: Optional[str] = None, snap_radius_km: float = 10.0,
+                 history: Optional[HistoryStore] = None):
+        # Both can be overridden, e.g. to point at benchmarks/mock_server.py
+        self.base_url = (base_url or os.environ.get("OWM_BASE_URL") or self.DEFAULT_BASE_URL).rstrip("/")
+        # Geocoding lives next to the data API unless configured separately
+        self.geo_url = (geo_url or os.environ.get("OWM_GEO_URL") or (
+            self.base_url[:-len("/data/2.5")] + "/geo/1.0" if self.base_url.endswith("/data/2.5") else self.DEFAULT_GEO_URL
+        )).rstrip("/")
+        self.api_key = api_key or os.environ.get("OWM_API_KEY") or self.DEFAULT_API_KEY
+        # Current conditions change quickly, the 3-hour forecast much less so
+        self.ttls = {"weather": current_ttl, "forecast": forecast_ttl}
+        self.cache = cache if cache is not None else TTLCache(max_entries=cache_size)
+        self.store = store
+        self.history = history
+        self.timeout = (connect_timeout, read_timeout)
+        # The session, and with it requests itself, is created on the first call
+        self._session = None
+        self._session_args = (max_retries, backoff_factor, pool_size)
+        self._session_lock = threading.Lock()
+        self.executor = ThreadPoolExecutor(max_workers=pool_size, thread_name_prefix="weather-fetch")
+        self._inflight: Dict[Tuple[str, str, str], Future] = {}
+        self._inflight_lock = threading.Lock()
+        # Normalized city name -> OpenWeatherMap city ID, learned from responses
+        self.city_ids: Dict[str, int] = store.get_city_ids() if store is not None else {}
+        self.city_index = city_index
+        # Free plan is 60 calls a minute; 0 turns the budget off (e.g. for the mock server)
+        if calls_per_minute is None:
+            calls_per_minute = float(os.environ.get("OWM_CALLS_PER_MINUTE", 60))
+        self.budget = RequestBudget(calls_per_minute) if calls_per_minute > 0 else None
+        # How long an interactive call may queue for budget before stale data is served
+        self.max_wait = max_wait
+        self._throttled_keys = set()
+        # ETag / Last-Modified per cache key, sent back when revalidating an expired entry
+        self.validators = TTLCache(max_entries=cache_size * 4)
+        # Where each cached observation was made, so nearby coordinates can reuse it
+        self.observations = SpatialIndex()
+        self.snap_radius_km = snap_radius_km
+        self.reverse_cache = TTLCache(max_entries=cache_size)
+
+    @property
+    def session(self) -> "requests.Session":
+        if self._session is None:
+            with self._session_lock:
+                if self._session is None:
+                    self._session = self._create_session(*self._session_args)
+        return self._session
+
+    @staticmethod
+    def _create_session(max_retries: int, backoff_factor: float, pool_size: int) -> "requests.Session":
+        # One keep-alive pool shared by every call, retrying server errors
+        # with exponential backoff. 429s are not retried here: a retry would
+        # only spend more quota, so they go back to the request budget
+        timed_adapter, bounded_retry = http_classes()
+        retry = bounded_retry(
+            total=max_retries,
+            backoff_factor=backoff_factor,
+            status_forcelist=(500, 502, 503, 504),
+            allowed_methods=frozenset(["GET"]),
+            respect_retry_after_header=True,
+            raise_on_status=False
+        )
+        adapter = timed_adapter(pool_connections=2, pool_maxsize=pool_size, max_retries=retry)
+        session = requests.Session()
+        # JSON compresses about 5x; ask for gzip explicitly rather than relying on defaults
+        session.headers["Accept-Encoding"] = "gzip, deflate"
+        session.mount("http://", adapter)
+        session.mount("https://", adapter)
+        return session
+
+    def close(self):
+        self.executor.shutdown(wait=False)
+        if self._session is not None:
+            self._session.close()
+
+    def resolve_city(self, city: str) -> Optional[CityMatch]:
+        if self.city_index is None:
+            return None
+        try:
+            return self.city_index.lookup(city)
+        except (OSError, ValueError) as e:
+            print(f"Error reading city index: {e}")
+            self.city_index = None
+            return None
+
+    def suggest_cities(self, text: str, limit: int = 8) -> List[CityMatch]:
+        if self.city_index is None:
+            return []
+        try:
+            return self.city_index.suggest(text, limit=limit)
+        except (OSError, ValueError) as e:
+            print(f"Error reading city index: {e}")
+            self.city_index = None
+            return []
+
+    def nearest_city(self, lat: float, lon: float, radius_km: Optional[float] = None) -> Optional[CityMatch]:
+        if self.city_index is None:
+            return None
+        try:
+            return self.city_index.nearest(lat, lon, self.snap_radius_km if radius_km is None else radius_km)
+        except (OSError, ValueError) as e:
+            print(f"Error reading city index: {e}")
+            self.city_index = None
+            return None
+
+    def locate(self, lat: float, lon: float, units: str = "metric", radius_km: Optional[float] = None,
+               max_age: Optional[float] = None) -> str:
+        # Name to fetch a point under, so nearby points share one cache entry
+        radius_km = self.snap_radius_km if radius_km is None else radius_km
+        max_age = self.ttls["weather"] if max_age is None else max_age
+        hit = self.observations.nearest(
+            lat, lon, radius_km, since=time.time() - max_age,
+            accept=lambda key: key[1] == units and self.cache.peek(("weather", *key)) is not None
+        )
+        if hit is not None:
+            metrics.increment("geo_snaps_total", source="observation")
+            return hit[0][0]
+        match = self.nearest_city(lat, lon, radius_km)
+        if match is not None:
+            metrics.increment("geo_snaps_total", source="gazetteer")
+            return match.name
+        return format_coordinates(lat, lon)
+
+    def canonical_city(self, city: str, units: str = "metric") -> str:
+        # Aliases and spelling variants ("Dahuk", "dohuk") collapse to one name,
+        # coordinates to whatever is known nearby
+        coordinates = parse_coordinates(city)
+        if coordinates is not None:
+            return self.locate(*coordinates, units=units)
+        match = self.resolve_city(city)
+        return match.name if match is not None else " ".join(city.split())
+
+    def cache_key(self, endpoint: str, city: str, units: str = "metric") -> Tuple[str, str, str]:
+        return (endpoint, self.canonical_city(city, units).casefold(), units)
+
+    def city_id_for(self, city: str) -> Optional[int]:
+        # From the gazetteer if it has one, else learned from earlier responses
+        match = self.resolve_city(city)
+        if match is not None and match.city_id:
+            return match.city_id
+        name = match.name if match is not None else " ".join(city.split())
+        return self.city_ids.get(name.casefold())
+
+    def _location_params(self, city: str) -> Dict[str, Any]:
+        if parse_coordinates(city) is not None:
+            city = self.canonical_city(city)
+            coordinates = parse_coordinates(city)
+            if coordinates is not None:
+                return {"lat": coordinates[0], "lon": coordinates[1]}
+        # Prefer an exact city ID over free-text matching on the upstream side
+        city_id = self.city_id_for(city)
+        if city_id:
+            return {"id": city_id}
+        match = self.resolve_city(city)
+        if match is not None and match.country:
+            return {"q": f"{match.name},{match.country}"}
+        return {"q": " ".join(city.split())}
+
+    def load_saved(self, endpoint: str, city: str, units: str = "metric") -> Optional[Tuple[float, Any]]:
+        # Last payload persisted by a previous fetch, possibly from an earlier session
+        if self.store is None:
+            return None
+        saved = self.store.get(self.cache_key(endpoint, city, units))
+        if saved is None:
+            return None
+        fetched_at, payload = saved
+        try:
+            return fetched_at, PARSERS[endpoint](payload)
+        except (KeyError, IndexError, TypeError) as e:
+            print(f"Error parsing saved {endpoint}: {e}")
+            return None
+
+    def peek(self, endpoint: str, city: str, units: str = "metric", stale: bool = False) -> Optional[Any]:
+        key = self.cache_key(endpoint, city, units)
+        return self.cache.stale(key) if stale else self.cache.peek(key)
+
+    def throttled_for(self) -> float:
+        return self.budget.wait_time() if self.budget is not None else 0.0
+
+    def is_throttled(self, endpoint: str, city: str, units: str = "metric") -> bool:
+        # True if the last attempt for this city was shed or rate limited, not answered
+        return self.cache_key(endpoint, city, units) in self._throttled_keys
+
+    def _acquire(self, endpoint: str, priority: int) -> bool:
+        if self.budget is None:
+            return True
+        # Background work never queues; it is shed as soon as the budget runs low
+        timeout = self.max_wait if priority == RequestBudget.INTERACTIVE else 0
+        if self.budget.acquire(priority, timeout):
+            return True
+        metrics.increment("upstream_shed_total", endpoint=endpoint, priority=priority)
+        return False
+
+    def _throttled(self, response: "requests.Response"):
+        retry_after = response.headers.get("Retry-After")
+        retry_after = float(retry_after) if retry_after and retry_after.isdigit() else None
+        print(f"Rate limited by the API, backing off for {retry_after or RequestBudget.DEFAULT_RETRY_AFTER:.0f}s")
+        if self.budget is not None:
+            self.budget.penalize(retry_after)
+
+    def _stale(self, key: Tuple[str, str, str], city: str, points: Optional[int] = None) -> Optional[Any]:
+        # Out of budget: the last known data beats an error. A full forecast
+        # also answers a request for fewer points.
+        self._throttled_keys.add(key)
+        data = self.cache.stale(key)
+        if data is None and points is not None:
+            data = self.cache.stale((*key, points))
+        if data is None and self.store is not None:
+            saved = self.load_saved(key[0], city, key[2])
+            if saved is not None:
+                data = saved[1]
+                # Cached already expired, so it is served again but never counts as fresh
+                self.cache.set(key, data, 0)
+        return data
+
+    def _remember(self, key: Tuple[str, str, str], payload: Dict, ttl: Optional[float] = None,
+                  points: Optional[int] = None) -> Any:
+        # Parse once; the cache keeps only the compact model, the store the raw payload.
+        # A forecast cut short by cnt is cached under its size and never persisted,
+        # so it cannot stand in for the full one.
+        with metrics.timer("model_parse_ms", endpoint=key[0]):
+            data = PARSERS[key[0]](payload)
+        cache_key = key if points is None else (*key, points)
+        self.cache.set(cache_key, data, ttl if ttl is not None else self.ttls[key[0]], payload=payload)
+        if self.store is not None and points is None:
+            self.store.put(key, payload)
+        if key[0] == "weather":
+            self.observations.add(key[1:], data.lat, data.lon, time.time())
+            if data.city_id:
+                self._learn_city_id(key[1], data.city_id)
+            # History is kept in metric only, so every series is comparable
+            if self.history is not None and key[2] == "metric":
+                self.history.record(key[1], data)
+        return data
+
+    def _learn_city_id(self, city: str, city_id: int):
+        if self.city_ids.get(city) == city_id:
+            return
+        self.city_ids[city] = city_id
+        if self.store is not None:
+            self.store.put_city_id(city, city_id)
+
+    def _get(self, endpoint: str, city: str, units: str, priority: int = RequestBudget.INTERACTIVE,
+             points: Optional[int] = None) -> Optional[Union[CurrentConditions, Forecast]]:
+        key = self.cache_key(endpoint, city, units)
+        # None for a full forecast; only shorter ones are asked for with cnt
+        points = points if endpoint == "forecast" and points and points < self.FORECAST_POINTS else None
+        flight = key if points is None else (*key, points)
+        # Read outside the lock: a shared cache is a network round trip. A
+        # leader finishing in between costs at most one extra fetch.
+        # The full forecast serves any request; a shorter one only its own size.
+        cached = self.cache.get(key)
+        if cached is None and points is not None:
+            cached = self.cache.get(flight)
+        if cached is not None:
+            return cached
+        # Single flight: identical requests arriving together share one upstream call
+        with self._inflight_lock:
+            future = self._inflight.get(flight)
+            leader = future is None
+            if leader:
+                future = Future()
+                self._inflight[flight] = future
+        if not leader:
+            return future.result()
+        
+        data = None
+        try:
+            data = self._fetch(key, city, priority, points)
+        finally:
+            with self._inflight_lock:
+                del self._inflight[flight]
+            future.set_result(data)
+        return data
+
+    def _request(self, endpoint: str, params: Dict, headers: Optional[Dict[str, str]] = None,
+                 base_url: Optional[str] = None) -> "requests.Response":
+        start = time.perf_counter()
+        response = self.session.get(
+            url=f"{base_url or self.base_url}/{endpoint}", params=params, headers=headers, timeout=self.timeout
+        )
+        # Body is read eagerly, so this covers the whole transfer
+        metrics.observe("upstream_total_ms", (time.perf_counter() - start) * 1000, endpoint=endpoint)
+        metrics.observe("upstream_ttfb_ms", response.elapsed.total_seconds() * 1000, endpoint=endpoint)
+        metrics.observe("upstream_payload_bytes", len(response.content), endpoint=endpoint)
+        # What actually crossed the network, before gzip decoding
+        wire_bytes = getattr(response.raw, "tell", None)
+        if wire_bytes is not None:
+            metrics.observe("upstream_wire_bytes", wire_bytes(), endpoint=endpoint)
+        metrics.increment("upstream_responses_total", endpoint=endpoint, status=response.status_code)
+        return response
+
+    @staticmethod
+    def _decode(response: "requests.Response") -> Dict:
+        with metrics.timer("json_decode_ms"):
+            return json_loads(response.content)
+
+    def _conditional_headers(self, key: Tuple[str, str, str], points: Optional[int]) -> Optional[Dict[str, str]]:
+        # Only worth asking "has it changed?" if there is an old copy to fall back on
+        validators = self.validators.get((*key, points))
+        if validators is None or self.cache.stale(key if points is None else (*key, points)) is None:
+            return None
+        return validators
+
+    def _remember_validators(self, key: Tuple[str, str, str], points: Optional[int], response: "requests.Response"):
+        # Keyed by cnt too: a validator only vouches for the exact request it came from
+        validators = {}
+        if response.headers.get("ETag"):
+            validators["If-None-Match"] = response.headers["ETag"]
+        if response.headers.get("Last-Modified"):
+            validators["If-Modified-Since"] = response.headers["Last-Modified"]
+        if validators:
+            self.validators.set((*key, points), validators, 86400)
+
+    def _max_age(self, response: "requests.Response") -> Optional[float]:
+        # Upstream's Cache-Control max-age, when given, replaces our own TTL
+        for directive in response.headers.get("Cache-Control", "").split(","):
+            name, _, value = directive.strip().partition("=")
+            if name.lower() == "max-age" and value.strip('"').isdigit():
+                return float(value.strip('"'))
+        return None
+
+    def _revalidated(self, key: Tuple[str, str, str], response: "requests.Response",
+                     points: Optional[int] = None) -> Optional[Any]:
+        # 304: the copy we already hold for this exact request is current again,
+        # with no body transferred
+        cache_key = key if points is None else (*key, points)
+        data = self.cache.stale(cache_key)
+        if data is not None:
+            max_age = self._max_age(response)
+            self.cache.set(cache_key, data, max_age if max_age is not None else self.ttls[key[0]])
+            if key[0] == "weather":
+                self.observations.add(key[1:], data.lat, data.lon, time.time())
+            if self.store is not None and points is None:
+                self.store.touch(key)
+        return data
+
+    def _fetch(self, key: Tuple[str, str, str], city: str, priority: int = RequestBudget.INTERACTIVE,
+               points: Optional[int] = None) -> Optional[Union[CurrentConditions, Forecast]]:
+        endpoint, _, units = key
+        label = "API" if endpoint == "weather" else "Forecast API"
+        if not self._acquire(endpoint, priority):
+            return self._stale(key, city, points)
+        try:
+            params = {
+                **self._location_params(city),
+                "appid": self.api_key,
+                "units": units
+            }
+            if points is not None:
+                params["cnt"] = points
+            response = self._request(endpoint, params, self._conditional_headers(key, points))
+            self._throttled_keys.discard(key)
+
+            if response.status_code == 200:
+                self._remember_validators(key, points, response)
+                return self._remember(key, self._decode(response), self._max_age(response), points)
+            elif response.status_code == 304:
+                return self._revalidated(key, response, points)
+            elif response.status_code == 429:
+                self._throttled(response)
+                return self._stale(key, city, points)
+            else:
+                print(f"{label} Error: {response.status_code} - {response.text}")
+                return None
+        except Exception as e:
+            print(f"Error fetching {endpoint}: {e}")
+            return None
+
+    def get_current_weather(self, city: str, units: str = "metric",
+                            priority: int = RequestBudget.INTERACTIVE) -> Optional[CurrentConditions]:
+        return self._get("weather", city, units, priority)
+
+    def get_forecast(self, city: str, units: str = "metric", priority: int = RequestBudget.INTERACTIVE,
+                     points: Optional[int] = None) -> Optional[Forecast]:
+        # points asks upstream for only the first N 3-hour steps (cnt)
+        return self._get("forecast", city, units, priority, points)
+
+    def history_for(self, city: str, seconds: float, buckets: int = 120) -> List[HistoryPoint]:
+        if self.history is None:
+            return []
+        end = int(time.time())
+        return self.history.query(self.cache_key("weather", city)[1], end - int(seconds), end, buckets)
+
+    def get_current_weather_at(self, lat: float, lon: float, units: str = "metric",
+                               priority: int = RequestBudget.INTERACTIVE, radius_km: Optional[float] = None,
+                               max_age: Optional[float] = None) -> Optional[CurrentConditions]:
+        # Served from any fresh observation or known city within radius_km before going upstream
+        return self.get_current_weather(self.locate(lat, lon, units, radius_km, max_age), units, priority)
+
+    def get_forecast_at(self, lat: float, lon: float, units: str = "metric",
+                        priority: int = RequestBudget.INTERACTIVE, radius_km: Optional[float] = None,
+                        points: Optional[int] = None) -> Optional[Forecast]:
+        return self.get_forecast(self.locate(lat, lon, units, radius_km), units, priority, points)
+
+    def reverse_geocode(self, lat: float, lon: float, limit: int = 1,
+                        priority: int = RequestBudget.INTERACTIVE) -> List[CityMatch]:
+        # Place names change rarely; cache per ~100 m for a day
+        key = ("reverse", round(lat, 3), round(lon, 3), limit)
+        cached = self.reverse_cache.get(key)
+        if cached is not None:
+            return cached
+        if not self._acquire("reverse", priority):
+            return self.reverse_cache.stale(key) or []
+        try:
+            params = {"lat": lat, "lon": lon, "limit": limit, "appid": self.api_key}
+            response = self._request("reverse", params, base_url=self.geo_url)
+            if response.status_code == 429:
+                self._throttled(response)
+                return self.reverse_cache.stale(key) or []
+            if response.status_code != 200:
+                print(f"Geocoding API Error: {response.status_code} - {response.text}")
+                return []
+            matches = [
+                CityMatch(place["name"], place.get("country", ""), place["lat"], place["lon"], 0)
+                for place in self._decode(response)
+            ]
+            self.reverse_cache.set(key, matches, 86400)
+            return matches
+        except Exception as e:
+            print(f"Error fetching reverse geocoding: {e}")
+            return []
+
+    def get_current_weather_many(self, cities: List[str], units: str = "metric",
+                                 priority: int = RequestBudget.INTERACTIVE) -> Dict[str, Optional[CurrentConditions]]:
+        results: Dict[str, Optional[CurrentConditions]] = {}
+        by_id: Dict[int, List[str]] = {}
+        unknown: List[str] = []
+        for city in cities:
+            key = self.cache_key("weather", city, units)
+            cached = self.cache.get(key)
+            city_id = self.city_id_for(city) if cached is None else None
+            if cached is not None:
+                results[city] = cached
+            elif city_id:
+                by_id.setdefault(city_id, []).append(city)
+            else:
+                unknown.append(city)
+        
+        # Cities with a known ID go out 20 at a time through /group
+        ids = list(by_id)
+        chunks = [ids[i:i + self.GROUP_LIMIT] for i in range(0, len(ids), self.GROUP_LIMIT)]
+        for chunk, group in zip(chunks, self.executor.map(lambda c: self._fetch_group(c, units, priority), chunks)):
+            for city_id in chunk:
+                data = group.get(city_id) if group is not None else None
+                for city in by_id[city_id]:
+                    key = self.cache_key("weather", city, units)
+                    if group is None:
+                        results[city] = self._stale(key, city)
+                    elif data is None:
+                        unknown.append(city)
+                    else:
+                        results[city] = self._remember(key, data)
+        
+        # Everything else falls back to parallel single calls, which also learns the IDs
+        futures = {city: self.get_current_weather_async(city, units, priority) for city in unknown}
+        for city, future in futures.items():
+            results[city] = future.result()
+        return {city: results.get(city) for city in cities}
+
+    def _fetch_group(self, city_ids: List[int], units: str,
+                     priority: int = RequestBudget.INTERACTIVE) -> Optional[Dict[int, Dict]]:
+        # None means no budget was left; the caller serves stale data instead
+        if not self._acquire("group", priority):
+            return None
+        try:
+            params = {
+                "id": ",".join(str(city_id) for city_id in city_ids),
+                "appid": self.api_key,
+                "units": units
+            }
+            response = self._request("group", params)
+            if response.status_code == 200:
+                return {item["id"]: item for item in self._decode(response).get("list", [])}
+            elif response.status_code == 429:
+                self._throttled(response)
+                return None
+            else:
+                print(f"Group API Error: {response.status_code} - {response.text}")
+                return {}
+        except Exception as e:
+            print(f"Error fetching group: {e}")
+            return {}
+
+    def get_current_weather_async(self, city: str, units: str = "metric",
+                                  priority: int = RequestBudget.INTERACTIVE) -> "Future[Optional[CurrentConditions]]":
+        return self.executor.submit(self._get, "weather", city, units, priority)
+
+    def get_forecast_async(self, city: str, units: str = "metric", priority: int = RequestBudget.INTERACTIVE,
+                           points: Optional[int] = None) -> "Future[Optional[Forecast]]":
+        return self.executor.submit(self._get, "forecast", city, units, priority, points)
+
+class FavoritesRefresher:
+    """Prefetches and periodically refreshes weather for every favorite city."""
+
+    def __init__(self, weather_api: WeatherAPI, cities: Callable[[], List[str]],
+                 on_refresh: Callable[[Dict[str, CurrentConditions]], None], interval: Optional[float] = None,
+                 jitter: float = 0.1, max_concurrency: int = 4):
+        self.weather_api = weather_api
+        self.cities = cities
+        self.on_refresh = on_refresh
+        # Refresh as current conditions expire, so each cycle does real work
+        self.interval = interval if interval is not None else weather_api.ttls["weather"]
+        self.jitter = jitter
+        self.max_concurrency = max_concurrency
+        self._stopped = threading.Event()
+        self._running = threading.Event()
+        self._wake = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self):
+        if self._thread is not None:
+            return
+        self._running.set()
+        self._thread = threading.Thread(target=self._run, name="favorites-refresher", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stopped.set()
+        self._running.set()
+        self._wake.set()
+
+    def pause(self):
+        self._running.clear()
+
+    def resume(self):
+        self._running.set()
+
+    def refresh_now(self):
+        self._wake.set()
+
+    def _run(self):
+        while not self._stopped.is_set():
+            self._running.wait()
+            if self._stopped.is_set():
+                return
+            self.refresh_all()
+            delay = self.interval * random.uniform(1 - self.jitter, 1 + self.jitter)
+            self._wake.wait(delay)
+            self._wake.clear()
+
+    def _refresh_forecast(self, city: str):
+        # Background priority: shed rather than compete with searches for quota
+        if self.weather_api.peek("forecast", city) is None and not self._stopped.is_set():
+            self.weather_api.get_forecast(city, priority=RequestBudget.BACKGROUND)
+
+    def refresh_all(self) -> Dict[str, CurrentConditions]:
+        cities = list(self.cities())
+        if not cities:
+            return {}
+        current = self.weather_api.get_current_weather_many(cities, priority=RequestBudget.BACKGROUND)
+        results = {city: data for city, data in current.items() if data is not None}
+        with ThreadPoolExecutor(max_workers=self.max_concurrency, thread_name_prefix="weather-refresh") as pool:
+            list(pool.map(self._refresh_forecast, cities))
+        if results and not self._stopped.is_set():
+            self.on_refresh(results)
+        return results
+
+@dataclass
+class FavoriteCity:
+    __slots__ = ("name", "country", "city_id", "lat", "lon")
+    name: str
+    country: str
+    city_id: int
+    lat: Optional[float]
+    lon: Optional[float]
+
+    def to_json(self) -> Dict:
+        return {"name": self.name, "country": self.country, "id": self.city_id, "lat": self.lat, "lon": self.lon}
+
+    @classmethod
+    def from_json(cls, data: Union[str, Dict]) -> "FavoriteCity":
+        if isinstance(data, str):
+            return cls(name=data, country="", city_id=0, lat=None, lon=None)
+        return cls(
+            name=data["name"],
+            country=data.get("country", ""),
+            city_id=data.get("id", 0) or 0,
+            lat=data.get("lat"),
+            lon=data.get("lon"),
+        )
+
+class FavoritesStore:
+    """Favorite cities persisted as versioned JSON.
+
+    Changes are applied in memory straight away and written by a timer
+    thread once they settle, so a burst of clicks costs one write and none
+    of it happens on the UI thread. Writes go to a temporary file that is
+    fsynced and renamed over the old one, so a crash leaves either the old
+    list or the new one, never half of each. A list saved by a newer
+    version is read as far as possible but never written over.
+    """
+
+    VERSION = 2
+    DEFAULTS = ["Duhok", "Erbil", "Kirkuk", "Mosul", "Sulaymaniah"]
+    # Seconds before a failed write is tried again
+    RETRY_DELAY = 5.0
+
+    def __init__(self, path: str, delay: float = 0.5,
+                 resolve: Optional[Callable[[str], Optional[CityMatch]]] = None, read_only: bool = False):
+        self.path = path
+        self.delay = delay
+        self.resolve = resolve
+        # Read the list and leave the file alone: no backups of bad files, no writes.
+        # A missing or unreadable list is then an error, not silently the defaults.
+        self.read_only = read_only
+        self._strict = read_only
+        self._lock = threading.RLock()
+        # Held across snapshot and write, so writes land in order and never share the temporary file
+        self._write_lock = threading.Lock()
+        self._timer: Optional[threading.Timer] = None
+        self._dirty = False
+        self._closed = False
+        self.entries: List[FavoriteCity] = self.load()
+
+    def _read(self) -> Any:
+        # Parsed JSON, or None if nothing has been saved yet
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return None
+
+    def _write(self, data: Dict):
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(data, f, indent=2, ensure_ascii=False)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.path)
+
+    def load(self) -> List[FavoriteCity]:
+        try:
+            data = self._read()
+        except (OSError, ValueError) as e:
+            if self._strict:
+                raise ValueError(f"unreadable favorites in {self.path}: {e}") from e
+            print(f"Error loading favorites: {e}")
+            self._keep_corrupt_copy()
+            return self._defaults()
+        if data is None:
+            if self._strict:
+                raise FileNotFoundError(f"no favorites saved in {self.path}")
+            return self._defaults()
+        if self._newer(data) and not self.read_only:
+            print("Favorites were saved by a newer version of the app; changes will not be saved")
+            self.read_only = True
+        try:
+            return self._dedupe(self._complete(FavoriteCity.from_json(item)) for item in self._migrate(data))
+        except (KeyError, TypeError, ValueError) as e:
+            if self._strict:
+                raise ValueError(f"unreadable favorites in {self.path}: {e}") from e
+            print(f"Error loading favorites: {e}")
+            if not self.read_only:
+                self._keep_corrupt_copy()
+            return self._defaults()
+
+    def _defaults(self) -> List[FavoriteCity]:
+        return self._dedupe(self._complete(FavoriteCity.from_json(name)) for name in self.DEFAULTS)
+
+    @classmethod
+    def _newer(cls, data: Any) -> bool:
+        version = data.get("version", 0) if isinstance(data, dict) else 0
+        return isinstance(version, int) and version > cls.VERSION
+
+    @classmethod
+    def _migrate(cls, data: Any) -> List:
+        # Version 1 was a bare list of names. Newer versions are read the same
+        # way as this one, in the hope they only added fields.
+        if isinstance(data, list):
+            return data
+        if not isinstance(data, dict) or not isinstance(data.get("favorites"), list):
+            raise ValueError(f"unsupported favorites format: {str(data)[:80]}")
+        return data["favorites"]
+
+    def _keep_corrupt_copy(self):
+        # Never overwrite a list we could not read without keeping a copy
+        backup_path = f"{self.path}.corrupt-{int(time.time())}"
+        try:
+            os.replace(self.path, backup_path)
+            print(f"Unreadable favorites moved to {backup_path}")
+        except OSError as e:
+            print(f"Error backing up favorites: {e}")
+
+    def _complete(self, entry: FavoriteCity) -> FavoriteCity:
+        # Entries migrated from names alone pick up the gazetteer's details
+        match = self.resolve(entry.name) if self.resolve is not None else None
+        if match is None or entry.city_id:
+            return entry
+        return FavoriteCity(match.name, match.country, match.city_id, match.lat, match.lon)
+
+    def _keys(self, name: str, city_id: int = 0) -> set:
+        # Same city under two spellings (Duhok/Dahuk) must not be listed twice
+        match = self.resolve(name) if self.resolve is not None else None
+        keys = {normalize_city_name(match.name if match is not None else name)}
+        if city_id:
+            keys.add(city_id)
+        return keys
+
+    def _dedupe(self, entries) -> List[FavoriteCity]:
+        seen = set()
+        unique = []
+        for entry in entries:
+            keys = self._keys(entry.name, entry.city_id)
+            if not keys & seen:
+                seen.update(keys)
+                unique.append(entry)
+        return unique
+
+    @property
+    def names(self) -> List[str]:
+        with self._lock:
+            return [entry.name for entry in self.entries]
+
+    def find(self, name: str, city_id: int = 0) -> Optional[FavoriteCity]:
+        keys = self._keys(name, city_id)
+        with self._lock:
+            for entry in self.entries:
+                if keys & self._keys(entry.name, entry.city_id):
+                    return entry
+        return None
+
+    def add(self, entry: FavoriteCity) -> bool:
+        with self._lock:
+            if self.find(entry.name, entry.city_id) is not None:
+                return False
+            self.entries.append(entry)
+            self._schedule()
+        return True
+
+    def remove(self, name: str) -> bool:
+        with self._lock:
+            entry = self.find(name)
+            if entry is None:
+                return False
+            self.entries.remove(entry)
+            self._schedule()
+        return True
+
+    def update(self, name: str, city_id: int, lat: float, lon: float, country: str = ""):
+        # Fill in details learned from a response; only written if something changed
+        with self._lock:
+            entry = self.find(name, city_id)
+            if entry is None:
+                return
+            changed = set_values((
+                (entry, "city_id", city_id or entry.city_id),
+                (entry, "lat", lat),
+                (entry, "lon", lon),
+                (entry, "country", country or entry.country),
+            ))
+            if changed:
+                self._schedule()
+
+    def _schedule(self, delay: Optional[float] = None):
+        # Every change pushes the write back, so it happens once things settle
+        with self._lock:
+            self._dirty = True
+            if self._closed:
+                return
+            if self._timer is not None:
+                self._timer.cancel()
+            self._timer = threading.Timer(self.delay if delay is None else delay, self.flush)
+            self._timer.daemon = True
+            self._timer.start()
+
+    def flush(self):
+        with self._write_lock:
+            with self._lock:
+                if self._timer is not None:
+                    self._timer.cancel()
+                    self._timer = None
+                if not self._dirty or self.read_only or self._closed:
+                    return
+                self._dirty = False
+                data = {"version": self.VERSION, "favorites": [entry.to_json() for entry in self.entries]}
+            try:
+                self._write(data)
+            except Exception as e:
+                print(f"Error saving favorites: {e}")
+                self._schedule(self.RETRY_DELAY)
+
+    def close(self):
+        # Nothing is written after this, including a pending or retrying write
+        with self._lock:
+            self._closed = True
+            if self._timer is not None:
+                self._timer.cancel()
+                self._timer = None
+
+class ClientFavoritesStore(FavoritesStore):
+    """Per-user favorites kept in the browser's local storage (server mode)."""
+
+    def __init__(self, client_storage, key: str = "weather.favorites", **kwargs):
+        self.client_storage = client_storage
+        super().__init__(key, **kwargs)
+
+    def _read(self) -> Any:
+        return self.client_storage.get(self.path)
+
+    def _write(self, data: Dict):
+        if not self.client_storage.set(self.path, data):
+            raise OSError("the browser rejected the write")
+
+    def _keep_corrupt_copy(self):
+        # The raw value can't be read back through client storage, only replaced
+        print(f"Unreadable favorites in client storage; '{self.path}' will be reset")
+
+class MemoryFavoritesStore(FavoritesStore):
+    """Favorites kept for the life of one session only, when nothing can store them."""
+
+    def __init__(self, **kwargs):
+        super().__init__("", **kwargs)
+
+    def _read(self) -> Any:
+        return None
+
+    def _write(self, data: Dict):
+        pass
+
+class PubSub:
+    """Minimal in-process publish/subscribe used to fan refreshes out to sessions."""
+
+    def __init__(self):
+        self._subscribers: Dict[str, List[Callable[[Any], None]]] = {}
+        self._lock = threading.Lock()
+
+    def subscribe(self, topic: str, callback: Callable[[Any], None]):
+        with self._lock:
+            self._subscribers.setdefault(topic, []).append(callback)
+
+    def unsubscribe(self, topic: str, callback: Callable[[Any], None]):
+        with self._lock:
+            callbacks = self._subscribers.get(topic, [])
+            if callback in callbacks:
+                callbacks.remove(callback)
+
+    def publish(self, topic: str, message: Any):
+        with self._lock:
+            callbacks = list(self._subscribers.get(topic, []))
+        for callback in callbacks:
+            try:
+                callback(message)
+            except Exception as e:
+                # One closed session must not stop the others from updating
+                print(f"Error delivering {topic} update: {e}")
+
+def default_city_index() -> CityIndex:
+    # Bundled gazetteer, or OpenWeatherMap's full city.list.json.gz if configured
+    city_list = os.environ.get("WEATHER_CITY_LIST") or os.path.join(
+        os.path.dirname(os.path.abspath(__file__)), "cities.csv"
+    )
+    return CityIndex(city_list)
+
+class SharedWeather:
+    """Fetch layer shared by every session of a server deployment.
+
+    One WeatherAPI (so one cache, one request budget and single-flight
+    across all users) and one refresher that keeps every city any session
+    is watching warm. Each refresh is published once on the "weather"
+    topic and every session picks out the cities it is showing.
+    """
+
+    def __init__(self, store_path: str = "weather_cache.db", history_path: str = "weather_history.db"):
+        self.weather_api = WeatherAPI(
+            store=WeatherStore.open(store_path),
+            history=HistoryStore.open(history_path),
+            city_index=default_city_index(),
+            cache=make_cache()
+        )
+        self.hub = PubSub()
+        self._watchers: Dict[int, Callable[[], List[str]]] = {}
+        self._lock = threading.Lock()
+        self.refresher = FavoritesRefresher(self.weather_api, cities=self.watched_cities, on_refresh=self._publish)
+
+    def watch(self, session_id: int, cities: Callable[[], List[str]]):
+        with self._lock:
+            self._watchers[session_id] = cities
+        self.refresher.start()
+        self.refresher.refresh_now()
+
+    def unwatch(self, session_id: int):
+        with self._lock:
+            self._watchers.pop(session_id, None)
+
+    def watched_cities(self) -> List[str]:
+        with self._lock:
+            watchers = list(self._watchers.values())
+        unique: Dict[str, str] = {}
+        for cities in watchers:
+            for city in cities():
+                unique.setdefault(self.weather_api.cache_key("weather", city)[1], city)
+        return list(unique.values())
+
+    def _publish(self, results: Dict[str, CurrentConditions]):
+        self.hub.publish("weather", results)
+
+class WeatherApp:
+    def __init__(self, weather_api: Optional[WeatherAPI] = None, favorites_store: Optional[FavoritesStore] = None):
+        self.favorite_file = "favorite_cities.json"
+        if weather_api is None:
+            # Saved payloads and history live next to the favorites file; the
+            # cache can be deleted at any time, the history is kept separately
+            data_dir = os.path.dirname(os.path.abspath(self.favorite_file))
+            weather_api = WeatherAPI(
+                store=WeatherStore.open(os.path.join(data_dir, "weather_cache.db")),
+                history=HistoryStore.open(os.path.join(data_dir, "weather_history.db")),
+                city_index=default_city_index()
+            )
+        self.weather_api = weather_api
+        if favorites_store is None:
+            favorites_store = FavoritesStore(self.favorite_file, resolve=weather_api.resolve_city)
+            # Pending writes must not be lost when the window closes
+            atexit.register(favorites_store.flush)
+        self.favorites_store = favorites_store
+
+    @property
+    def favorites(self) -> List[str]:
+        return self.favorites_store.names
+
+    def add_favorite(self, city: str) -> bool:
+        conditions = self.weather_api.peek("weather", city)
+        match = self.weather_api.resolve_city(city)
+        if conditions is not None:
+            entry = FavoriteCity(conditions.name, conditions.country, conditions.city_id, conditions.lat, conditions.lon)
+        elif match is not None:
+            entry = FavoriteCity(match.name, match.country, match.city_id, match.lat, match.lon)
+        else:
+            entry = FavoriteCity(city, "", self.weather_api.city_id_for(city) or 0, None, None)
+        return self.favorites_store.add(entry)
+
+    def remove_favorite(self, city: str) -> bool:
+        return self.favorites_store.remove(city)
+
+    def learn_favorites(self, results: Dict[str, CurrentConditions]):
+        for city, conditions in results.items():
+            self.favorites_store.update(city, conditions.city_id, conditions.lat, conditions.lon, conditions.country)
+
+class UpdateScheduler:
+    """Collects dirty controls and flushes them with one page.update() per tick.
+
+    In web mode every update is a websocket round trip, so a search that
+    touches the status line, the current card and the forecast strip
+    should cost one diff, not three.
+    """
+
+    def __init__(self, flush: Callable[..., None], interval: float = 1 / 60):
+        self._flush = flush
+        self.interval = interval
+        self._dirty: Dict[int, Any] = {}
+        self._lock = threading.Lock()
+        self._timer: Optional[threading.Timer] = None
+        self.marks = 0
+        self.flushes = 0
+
+    def mark(self, *controls):
+        if not controls:
+            return
+        with self._lock:
+            for control in controls:
+                self._dirty.setdefault(id(control), control)
+            self.marks += len(controls)
+            if self._timer is None:
+                self._timer = threading.Timer(self.interval, self.flush)
+                self._timer.daemon = True
+                self._timer.start()
+
+    def flush(self):
+        with self._lock:
+            controls = list(self._dirty.values())
+            self._dirty.clear()
+            if self._timer is not None:
+                self._timer.cancel()
+                self._timer = None
+        if controls:
+            self.flushes += 1
+            with metrics.timer("page_update_ms", controls=len(controls)):
+                self._flush(*controls)
+
+def get_weather_icon(weather_code: str) -> str:
+    icon_map = {
+        "01d": "☀️", "01n": "🌙",  # Clear sky
+        "02d": "⛅", "02n": "⛅",  # Few clouds
+        "03d": "☁️", "03n": "☁️",  # Scattered clouds
+        "04d": "☁️", "04n": "☁️",  # Broken clouds
+        "09d": "🌧️", "09n": "🌧️",  # Shower rain
+        "10d": "🌦️", "10n": "🌧️",  # Rain
+        "11d": "⛈️", "11n": "⛈️",  # Thunderstorm
+        "13d": "❄️", "13n": "❄️",  # Snow
+        "50d": "🌫️", "50n": "🌫️",  # Mist
+    }
+    return icon_map.get(weather_code, "🌤️")
+
+def set_values(changes) -> bool:
+    # Apply (control, attribute, value) triples, touching only what differs
+    changed = False
+    for control, attr, value in changes:
+        if getattr(control, attr) != value:
+            setattr(control, attr, value)
+            changed = True
+    return changed
+
+class CurrentWeatherView:
+    """Current conditions panel, built once and updated in place."""
+
+    def __init__(self, on_favorite: Callable[[str], None]):
+        self.city_name = ""
+        self.title = ft.Text("", size=26, weight=ft.FontWeight.BOLD)
+        self.timestamp = ft.Text("", size=14, color=ft.Colors.GREY_500)
+        self.icon = ft.Text("", size=100)
+        self.description = ft.Text("", size=18, weight=ft.FontWeight.BOLD, text_align=ft.TextAlign.CENTER)
+        self.temp = ft.Text("", size=54, weight=ft.FontWeight.BOLD, color=ft.Colors.BLUE_800)
+        self.feels_like = ft.Text("", size=16, color=ft.Colors.GREY_600)
+        self.humidity = ft.Text("", size=16, weight=ft.FontWeight.BOLD)
+        self.wind = ft.Text("", size=16, weight=ft.FontWeight.BOLD)
+        self.pressure = ft.Text("", size=16, weight=ft.FontWeight.BOLD)
+        self.sunrise = ft.Text("", size=16, weight=ft.FontWeight.BOLD)
+        self.sunset = ft.Text("", size=16, weight=ft.FontWeight.BOLD)
+
+        self.control = ft.Column(
+            controls=[
+                ft.Row(
+                    controls=[
+                        self.title,
+                        ft.IconButton(
+                            ft.Icons.FAVORITE_BORDER, 
+                            icon_color=ft.Colors.RED_400, 
+                            on_click=lambda e: on_favorite(self.city_name),
+                            tooltip="Add to favorites",
+                            icon_size=28
+                        )
+                    ],
+                    alignment=ft.MainAxisAlignment.SPACE_BETWEEN
+                ),
+                self.timestamp,
+                ft.Row(
+                    controls=[
+                        ft.Column(
+                            controls=[self.icon, self.description],
+                            horizontal_alignment=ft.CrossAxisAlignment.CENTER,
+                            spacing=10
+                        ),
+                        ft.Column(
+                            controls=[self.temp, self.feels_like],
+                            horizontal_alignment=ft.CrossAxisAlignment.CENTER,
+                            spacing=5
+                        )
+                    ],
+                    alignment=ft.MainAxisAlignment.SPACE_AROUND
+                ),
+                ft.Row(
+                    controls=[
+                        self._stat(ft.Icons.WATER_DROP, ft.Colors.BLUE_400, "Humidity", self.humidity),
+                        self._stat(ft.Icons.AIR, ft.Colors.GREY_600, "Wind", self.wind),
+                        self._stat(ft.Icons.SPEED, ft.Colors.ORANGE_400, "Pressure", self.pressure),
+                        self._stat(ft.Icons.WB_SUNNY, ft.Colors.YELLOW_600, "Sunrise", self.sunrise),
+                        self._stat(ft.Icons.NIGHTLIGHT, ft.Colors.PURPLE_400, "Sunset", self.sunset),
+                    ],
+                    spacing=10
+                )
+            ],
+            spacing=15
+        )
+
+    @staticmethod
+    def _stat(icon: str, color: str, label: str, value: "ft.Text") -> "ft.Container":
+        return ft.Container(
+            content=ft.Column(
+                controls=[
+                    ft.Icon(icon, color=color, size=20),
+                    ft.Text(label, size=12, color=ft.Colors.GREY_600),
+                    value,
+                ],
+                horizontal_alignment=ft.CrossAxisAlignment.CENTER,
+                spacing=5
+            ),
+            expand=True
+        )
+
+    def show(self, conditions: CurrentConditions) -> bool:
+        self.city_name = conditions.name
+        # Convert sunrise/sunset from Unix timestamp
+        sunrise = datetime.datetime.fromtimestamp(conditions.sunrise).strftime("%I:%M %p")
+        sunset = datetime.datetime.fromtimestamp(conditions.sunset).strftime("%I:%M %p")
+        
+        return set_values((
+            (self.title, "value", f"{conditions.name}, {conditions.country}"),
+            (self.timestamp, "value", datetime.datetime.now().strftime("%A, %B %d, %Y - %I:%M %p")),
+            (self.icon, "value", get_weather_icon(conditions.icon)),
+            (self.description, "value", conditions.description.title()),
+            (self.temp, "value", f"{round(conditions.temp)}°C"),
+            (self.feels_like, "value", f"Feels like {round(conditions.feels_like)}°C"),
+            (self.humidity, "value", f"{conditions.humidity}%"),
+            (self.wind, "value", f"{conditions.wind_speed} m/s"),
+            (self.pressure, "value", f"{conditions.pressure} hPa"),
+            (self.sunrise, "value", sunrise),
+            (self.sunset, "value", sunset),
+        ))
+
+class ForecastCard:
+    """One day of the 5-day forecast strip, reused across searches."""
+
+    def __init__(self):
+        self.day = ft.Text("", size=16, weight=ft.FontWeight.BOLD)
+        self.date = ft.Text("", size=12, color=ft.Colors.GREY_600)
+        self.icon = ft.Text("", size=36)
+        self.temp = ft.Text("", size=18, weight=ft.FontWeight.BOLD, color=ft.Colors.BLUE_800)
+        self.range = ft.Text("", size=12, color=ft.Colors.GREY_600)
+        self.description = ft.Text("", size=10, color=ft.Colors.GREY_600, text_align=ft.TextAlign.CENTER)
+        self.details = ft.Text("", size=10, color=ft.Colors.GREY_600, text_align=ft.TextAlign.CENTER)
+        self.control = ft.Container(
+            content=ft.Column(
+                controls=[self.day, self.date, self.icon, self.temp, self.range, self.description, self.details],
+                horizontal_alignment=ft.CrossAxisAlignment.CENTER,
+                spacing=5
+            ),
+            padding=15,
+            bgcolor=ft.Colors.WHITE,
+            border=ft.border.all(2, ft.Colors.BLUE_200),
+            border_radius=12,
+            width=130,
+            margin=ft.margin.only(right=10)
+        )
+
+    def show(self, summary: DailySummary) -> bool:
+        date = summary.date
+        return set_values((
+            (self.day, "value", date.strftime("%a")),
+            (self.date, "value", date.strftime("%m/%d")),
+            (self.icon, "value", get_weather_icon(summary.icon)),
+            (self.temp, "value", f"{round(summary.temp_mean)}°C"),
+            (self.range, "value", f"{round(summary.temp_min)}° / {round(summary.temp_max)}°"),
+            (self.description, "value", summary.description.title()),
+            (self.details, "value", f"{summary.precipitation:.1f} mm · {summary.wind_max:.0f} m/s"),
+        ))
+
+class TrendChart:
+    """Temperature history for the city on screen, over a selectable range."""
+
+    RANGES = {"24h": 86400, "7d": 7 * 86400, "30d": 30 * 86400}
+
+    def __init__(self, on_range: Callable[[str], None]):
+        self.range = "24h"
+        self._shown: Optional[Tuple] = None
+        self.series = ft.LineChartData(
+            data_points=[],
+            curved=True,
+            prevent_curve_over_shooting=True,
+            stroke_width=2,
+            color=ft.Colors.BLUE_600,
+            below_line_bgcolor=ft.Colors.with_opacity(0.1, ft.Colors.BLUE_600)
+        )
+        self.chart = ft.LineChart(
+            data_series=[self.series],
+            left_axis=ft.ChartAxis(labels_size=40),
+            bottom_axis=ft.ChartAxis(labels_size=28),
+            horizontal_grid_lines=ft.ChartGridLines(color=ft.Colors.GREY_200, width=1),
+            tooltip_bgcolor=ft.Colors.with_opacity(0.8, ft.Colors.BLUE_GREY_800),
+            height=180,
+            visible=False
+        )
+        self.empty = ft.Text("No history recorded for this city yet", size=14, color=ft.Colors.GREY_500)
+        self.selector = ft.SegmentedButton(
+            segments=[ft.Segment(value=name, label=ft.Text(name)) for name in self.RANGES],
+            selected={self.range},
+            on_change=lambda e: self._select(on_range)
+        )
+        self.control = ft.Column(controls=[self.selector, self.chart, self.empty], spacing=10)
+
+    def _select(self, on_range: Callable[[str], None]):
+        self.range = next(iter(self.selector.selected), self.range)
+        on_range(self.range)
+
+    def show(self, points: List[HistoryPoint]) -> bool:
+        shown = (self.range, tuple((point.dt, point.temp) for point in points))
+        if shown == self._shown:
+            return False
+        self._shown = shown
+        if len(points) < 2:
+            self.series.data_points = []
+            set_values(((self.chart, "visible", False), (self.empty, "visible", True)))
+            return True
+        self.series.data_points = [
+            ft.LineChartDataPoint(
+                point.dt, round(point.temp, 1),
+                tooltip=f"{point.temp:.1f}°C ({point.temp_min:.0f}° / {point.temp_max:.0f}°)"
+            )
+            for point in points
+        ]
+        low = min(point.temp_min for point in points)
+        high = max(point.temp_max for point in points)
+        self.chart.min_y = math.floor(low) - 1
+        self.chart.max_y = math.ceil(high) + 1
+        self.chart.min_x, self.chart.max_x = points[0].dt, points[-1].dt
+        # A handful of time labels; clock times for a day, dates beyond that
+        label_format = "%H:%M" if self.range == "24h" else "%m/%d"
+        step = (points[-1].dt - points[0].dt) / 4
+        self.chart.bottom_axis.labels = [
+            ft.ChartAxisLabel(
+                value=points[0].dt + i * step,
+                label=ft.Text(
+                    datetime.datetime.fromtimestamp(points[0].dt + i * step).strftime(label_format),
+                    size=10, color=ft.Colors.GREY_600
+                )
+            )
+            for i in range(5)
+        ]
+        set_values(((self.chart, "visible", True), (self.empty, "visible", False)))
+        return True
+
+class FavoriteCard:
+    """Sidebar entry for one favorite city, showing its live conditions."""
+
+    def __init__(self, city: str, on_open: Callable[[str], None], on_remove: Callable[[str], None]):
+        self.city = city
+        self.placeholder_icon = ft.Icon(ft.Icons.LOCATION_CITY, color=ft.Colors.BLUE_400, size=20)
+        self.icon = ft.Text("", size=20, visible=False)
+        self.temp = ft.Text("", size=16, weight=ft.FontWeight.BOLD, color=ft.Colors.BLUE_800)
+        self.control = ft.Container(
+            content=ft.Row(
+                controls=[
+                    self.placeholder_icon,
+                    self.icon,
+                    ft.Text(city, size=16, expand=True, weight=ft.FontWeight.W_500),
+                    self.temp,
+                    ft.IconButton(
+                        ft.Icons.DELETE_OUTLINE, 
+                        icon_color=ft.Colors.RED_400, 
+                        on_click=lambda e: on_remove(city), 
+                        tooltip="Remove from favorites",
+                        icon_size=20
+                    )
+                ],
+                spacing=10
+            ),
+            padding=12,
+            bgcolor=ft.Colors.GREY_50,
+            border_radius=10,
+            margin=ft.margin.only(bottom=8),
+            on_click=lambda e: on_open(city),
+            ink=True,
+            border=ft.border.all(1, ft.Colors.GREY_200)
+        )
+
+    def show(self, conditions: Optional[CurrentConditions]) -> bool:
+        if conditions is None:
+            return set_values((
+                (self.placeholder_icon, "visible", True),
+                (self.icon, "visible", False),
+                (self.temp, "value", ""),
+            ))
+        return set_values((
+            (self.placeholder_icon, "visible", False),
+            (self.icon, "visible", True),
+            (self.icon, "value", get_weather_icon(conditions.icon)),
+            (self.temp, "value", f"{round(conditions.temp)}°C"),
+        ))
+
+def sync_keyed(container, cards: Dict[str, Any], items: List[Tuple[str, Any]],
+               create: Callable[[str], Any], mark: Callable[..., None], recycle: bool = False):
+    """Reconcile a list control against keyed items, reusing cards by key.
+
+    Only cards whose data changed are updated; the container itself is only
+    updated when cards were added, removed or reordered.
+    """
+    keys = {key for key, _ in items}
+    dropped = [key for key in cards if key not in keys]
+    changed_cards = []
+    for key, data in items:
+        card = cards.get(key)
+        if card is None:
+            # Recycle a card whose key went away before building a new one
+            card = cards.pop(dropped.pop()) if recycle and dropped else create(key)
+            cards[key] = card
+        if card.show(data):
+            changed_cards.append(card)
+    for key in dropped:
+        del cards[key]
+    
+    controls = [cards[key].control for key, _ in items]
+    if controls != container.controls:
+        container.controls = controls
+        mark(container)
+    else:
+        mark(*(card.control for card in changed_cards))
+
+def weatherapp(page: "ft.Page", shared: Optional[SharedWeather] = None):
+    page.title = "Weather Dashboard"
+    page.theme_mode = ft.ThemeMode.LIGHT
+    page.padding = 10
+    page.window.width = 1200
+    page.window.height = 700
+    page.window.center()
+    page.scroll = ft.ScrollMode.HIDDEN
+    
+    # Try to set icon, but don't fail if file doesn't exist
+    try:
+        page.window.icon = "weather.ico"
+    except:
+        pass
+    
+    # Staged startup: the header and search box are painted first; the
+    # stores, favorites and the first city's weather follow from a worker
+    started = time.perf_counter()
+    weather_app: Optional[WeatherApp] = None
+    refresher: Optional[FavoritesRefresher] = None
+    app_ready = threading.Event()
+    
+    # All UI mutations mark their controls dirty and go out in one batched update
+    ui = UpdateScheduler(page.update)
+    
+    # Each search bumps the generation; results from an older one are dropped
+    search_state = {"generation": 0, "city": None, "trend_city": None}
+    render_lock = threading.RLock()
+
+    def show_status(message: str, color: str):
+        if set_values(((status_text, "value", message), (status_text, "color", color))):
+            ui.mark(status_text)
+
+    def search_weather(background: bool = False):
+        city = city_input.value.strip()
+        if not city:
+            show_status("Please enter a city name", ft.Colors.RED_400)
+            return
+        
+        hide_suggestions()
+        generation = next_generation()
+        
+        if not background:
+            show_status("Loading weather data...", ft.Colors.BLUE_400)
+        
+        # Fetch off the UI event thread so the window stays responsive
+        page.run_thread(fetch_weather, city, generation)
+
+    def next_generation() -> int:
+        with render_lock:
+            search_state["generation"] += 1
+            return search_state["generation"]
+
+    def fetch_weather(city: str, generation: int):
+        # A search typed while the app is still starting waits for it here
+        app_ready.wait()
+        if weather_app is None:
+            return
+        # Search by the gazetteer name so aliases share one cache entry
+        city = weather_app.weather_api.canonical_city(city)
+        # Both endpoints are requested at once, so the wait is the slower of the two
+        current_future = weather_app.weather_api.get_current_weather_async(city)
+        forecast_future = weather_app.weather_api.get_forecast_async(city)
+        current_weather = current_future.result()
+        with render_lock:
+            if generation != search_state["generation"]:
+                return
+            if current_weather:
+                search_state["city"] = city
+                show_current_weather(current_weather)
+                show_status(f"Weather data loaded for {current_weather.name}", ft.Colors.GREEN_600)
+            elif not show_saved_weather(city):
+                if weather_app.weather_api.is_throttled("weather", city):
+                    # Out of API quota is not the same as a misspelled city
+                    wait = max(1, round(weather_app.weather_api.throttled_for()))
+                    show_status(f"Too many requests right now. Please try again in {wait} seconds.", ft.Colors.ORANGE_600)
+                else:
+                    message = f"Could not find weather data for '{city}'. Please check the city name and try again."
+                    close = weather_app.weather_api.suggest_cities(city, limit=1)
+                    if close and close[0].name.casefold() != city.casefold():
+                        message = f"Could not find weather data for '{city}'. Did you mean {close[0].name}?"
+                    show_status(message, ft.Colors.RED_400)
+                return
+        # History is local, so the trend is shown offline too
+        update_trend(city, generation)
+        if not current_weather:
+            return
+        
+        forecast = forecast_future.result()
+        with render_lock:
+            if generation == search_state["generation"] and forecast:
+                update_forecast_display(forecast)
+
+    def show_saved_weather(city: str, refreshing: bool = False) -> bool:
+        saved = weather_app.weather_api.load_saved("weather", city)
+        if saved is None:
+            return False
+        fetched_at, current_weather = saved
+        show_current_weather(current_weather)
+        saved_forecast = weather_app.weather_api.load_saved("forecast", city)
+        if saved_forecast is not None:
+            update_forecast_display(saved_forecast[1])
+        
+        saved_time = datetime.datetime.fromtimestamp(fetched_at).strftime("%b %d, %I:%M %p")
+        if refreshing:
+            message = f"Showing saved data for {current_weather.name} from {saved_time}, refreshing..."
+        else:
+            message = f"Offline: showing saved data for {current_weather.name} from {saved_time}"
+        show_status(message, ft.Colors.ORANGE_600)
+        return True
+
+    # UI Components
+    city_input = ft.TextField(
+        label="Enter city name", 
+        hint_text="e.g., Erbil, Duhok, Baghdad, London", 
+        expand=True, 
+        on_submit=lambda e: search_weather(),
+        on_change=lambda e: schedule_suggestions(),
+        border_radius=10
+    )
+    
+    search_button = ft.ElevatedButton(
+        "Search Weather", 
+        icon=ft.Icons.SEARCH, 
+        on_click=lambda e: search_weather(),
+        style=ft.ButtonStyle(
+            bgcolor=ft.Colors.BLUE_600, 
+            color=ft.Colors.WHITE,
+            shape=ft.RoundedRectangleBorder(radius=10)
+        ),
+        height=50
+    )
+    
+    current_weather_card = ft.Container(
+        content=ft.Column(
+            controls=[
+                ft.Icon(ft.Icons.CLOUD, size=60, color=ft.Colors.GREY_400),
+                ft.Text("Enter a city name and click search to view current weather", 
+                       size=16, 
+                       text_align=ft.TextAlign.CENTER,
+                       color=ft.Colors.GREY_600)
+            ],
+            horizontal_alignment=ft.CrossAxisAlignment.CENTER,
+            spacing=20
+        ),
+        padding=30,
+        bgcolor=ft.Colors.BLUE_50,
+        border_radius=15,
+        height=320,
+        alignment=ft.alignment.center
+    )
+    
+    forecast_container = ft.Row(
+        controls=[],
+        scroll=ft.ScrollMode.AUTO,
+        spacing=10
+    )
+    trend_view = TrendChart(on_range=lambda name: refresh_trend())
+    
+    favorites_list = ft.Column()
+    favorites_empty = ft.Container(
+        content=ft.Text("No favorite cities yet", size=14, color=ft.Colors.GREY_500),
+        padding=20,
+        alignment=ft.alignment.center,
+        visible=False
+    )
+    favorites_container = ft.Column(
+        controls=[
+            ft.Row(
+                controls=[
+                    ft.Icon(ft.Icons.FAVORITE, color=ft.Colors.RED_400, size=24),
+                    ft.Text("Favorite Cities", size=20, weight=ft.FontWeight.BOLD)
+                ],
+                spacing=10
+            ),
+            favorites_empty,
+            favorites_list
+        ]
+    )
+    status_text = ft.Text("Loading favorites...", color=ft.Colors.GREY_600, size=14)
+    suggestions_list = ft.Column(spacing=0)
+    suggestions_box = ft.Container(
+        content=suggestions_list,
+        bgcolor=ft.Colors.WHITE,
+        border_radius=10,
+        border=ft.border.all(1, ft.Colors.GREY_200),
+        visible=False
+    )
+    suggest_state = {"timer": None}
+    snackbar = ft.SnackBar(content=ft.Text(""))
+    page.overlay.append(snackbar)
+
+    # Persistent views: later data only mutates their values
+    current_view = CurrentWeatherView(on_favorite=lambda city: add_to_favorites(city))
+    forecast_cards: Dict[str, ForecastCard] = {}
+    favorite_cards: Dict[str, FavoriteCard] = {}
+
+    def show_current_weather(conditions: CurrentConditions):
+        with metrics.timer("ui_build_ms", view="current"):
+            changed = current_view.show(conditions)
+        if current_weather_card.content is not current_view.control:
+            # First result replaces the placeholder; afterwards only values change
+            current_weather_card.content = current_view.control
+            ui.mark(current_weather_card)
+        elif changed:
+            ui.mark(current_view.control)
+
+    def schedule_suggestions():
+        # Debounced so a burst of keystrokes costs one index lookup
+        with render_lock:
+            if suggest_state["timer"] is not None:
+                suggest_state["timer"].cancel()
+            suggest_state["timer"] = threading.Timer(0.15, show_suggestions, args=(city_input.value or "",))
+            suggest_state["timer"].daemon = True
+            suggest_state["timer"].start()
+
+    def show_suggestions(text: str):
+        app_ready.wait()
+        if weather_app is None:
+            return
+        matches = weather_app.weather_api.suggest_cities(text) if len(text.strip()) >= 2 else []
+        with render_lock:
+            # Dropped if the user kept typing or already searched
+            if suggest_state["timer"] is None or text != (city_input.value or ""):
+                return
+            if len(matches) == 1 and matches[0].name.casefold() == text.strip().casefold():
+                matches = []
+            suggestions_list.controls = [
+                ft.ListTile(
+                    title=ft.Text(match.name),
+                    subtitle=ft.Text(match.country) if match.country else None,
+                    leading=ft.Icon(ft.Icons.LOCATION_CITY, color=ft.Colors.BLUE_400),
+                    dense=True,
+                    on_click=lambda e, name=match.name: load_city_weather(name)
+                )
+                for match in matches
+            ]
+            suggestions_box.visible = bool(matches)
+            ui.mark(suggestions_box)
+
+    def hide_suggestions():
+        with render_lock:
+            if suggest_state["timer"] is not None:
+                suggest_state["timer"].cancel()
+                suggest_state["timer"] = None
+            if set_values(((suggestions_box, "visible", False),)):
+                ui.mark(suggestions_box)
+
+    def show_snackbar(message: str, color: str):
+        snackbar.content.value = message
+        snackbar.bgcolor = color
+        snackbar.open = True
+        ui.mark(snackbar)
+
+    def load_city_weather(city: str):
+        city_input.value = city
+        ui.mark(city_input)
+        search_weather()
+
+    def remove_from_favorites(city: str):
+        weather_app.remove_favorite(city=city)
+        update_favorites_display()
+        # Show removal confirmation
+        show_snackbar(f"Removed {city} from favorites", ft.Colors.ORANGE_600)
+
+    def update_forecast_display(forecast: Forecast):
+        # Show next 5 days, with the real daily range rather than one sample
+        with metrics.timer("forecast_aggregate_ms"):
+            daily_forecasts = [(str(summary.day), summary) for summary in aggregate_daily(forecast, days=5)]
+        with render_lock, metrics.timer("ui_build_ms", view="forecast"):
+            sync_keyed(forecast_container, forecast_cards, daily_forecasts, lambda key: ForecastCard(), ui.mark, recycle=True)
+
+    def update_trend(city: str, generation: int):
+        points = weather_app.weather_api.history_for(city, TrendChart.RANGES[trend_view.range])
+        with render_lock, metrics.timer("ui_build_ms", view="trend"):
+            if generation != search_state["generation"]:
+                return
+            search_state["trend_city"] = city
+            if trend_view.show(points):
+                ui.mark(trend_view.control)
+
+    def refresh_trend():
+        if search_state["trend_city"] is not None:
+            page.run_thread(update_trend, search_state["trend_city"], search_state["generation"])
+
+    def add_to_favorites(city: str):
+        if weather_app.add_favorite(city):
+            update_favorites_display()
+            refresher.refresh_now()
+            show_snackbar(f"Added {city} to favorites! ⭐", ft.Colors.GREEN_600)
+        else:
+            show_snackbar(f"{city} is already in your favorites", ft.Colors.ORANGE_600)
+
+    def update_favorites_display():
+        # Live conditions kept warm by the background refresher
+        # Last known values, even if expired, beat an empty card
+        items = [(city, weather_app.weather_api.peek("weather", city, stale=True)) for city in weather_app.favorites]
+        with render_lock, metrics.timer("ui_build_ms", view="favorites"):
+            if set_values(((favorites_empty, "visible", not items),)):
+                ui.mark(favorites_empty)
+            sync_keyed(
+                favorites_list,
+                favorite_cards,
+                items,
+                lambda city: FavoriteCard(city, on_open=load_city_weather, on_remove=remove_from_favorites),
+                ui.mark
+            )
+
+    # Main page layout; the header and search box are the first paint
+    header = ft.Container(
+        content=ft.Row(
+            controls=[
+                ft.Icon(ft.Icons.WB_SUNNY, color=ft.Colors.ORANGE_400, size=32),
+                ft.Text(
+                    "Weather Dashboard", 
+                    size=32, 
+                    weight=ft.FontWeight.BOLD, 
+                    color=ft.Colors.BLUE_800
+                )
+            ],
+            alignment=ft.MainAxisAlignment.CENTER,
+            spacing=15
+        ), 
+        padding=ft.padding.only(bottom=20)
+    )
+    search_section = ft.Container(
+        content=ft.Column(
+            controls=[
+                ft.Row(
+                    controls=[
+                        city_input,
+                        search_button
+                    ],
+                    spacing=15
+                ),
+                suggestions_box,
+                status_text
+            ],
+            spacing=10
+        ),
+        padding=25,
+        bgcolor=ft.Colors.GREY_50,
+        border_radius=15,
+        margin=ft.margin.only(bottom=20),
+        border=ft.border.all(1, ft.Colors.GREY_200)
+    )
+    main_content = ft.Row(
+        controls=[
+            # Weather and forecast section
+            ft.Column(
+                controls=[
+                    current_weather_card,
+                    ft.Container(
+                        content=ft.Column(
+                            controls=[
+                                ft.Row(
+                                    controls=[
+                                        ft.Icon(ft.Icons.CALENDAR_MONTH, color=ft.Colors.BLUE_600, size=24),
+                                        ft.Text("5-Day Forecast", size=20, weight=ft.FontWeight.BOLD)
+                                    ],
+                                    spacing=10
+                                ),
+                                forecast_container
+                            ],
+                            spacing=15
+                        ),
+                        padding=25,
+                        bgcolor=ft.Colors.GREY_50,
+                        border_radius=15,
+                        margin=ft.margin.only(top=20),
+                        border=ft.border.all(1, ft.Colors.GREY_200)
+                    ),
+                    ft.Container(
+                        content=ft.Column(
+                            controls=[
+                                ft.Row(
+                                    controls=[
+                                        ft.Icon(ft.Icons.SHOW_CHART, color=ft.Colors.BLUE_600, size=24),
+                                        ft.Text("Temperature Trend", size=20, weight=ft.FontWeight.BOLD)
+                                    ],
+                                    spacing=10
+                                ),
+                                trend_view.control
+                            ],
+                            spacing=15
+                        ),
+                        padding=25,
+                        bgcolor=ft.Colors.GREY_50,
+                        border_radius=15,
+                        margin=ft.margin.only(top=20),
+                        border=ft.border.all(1, ft.Colors.GREY_200)
+                    )
+                ],
+                expand=3
+            ),
+
+            # Favorites section
+            ft.Container(
+                content=favorites_container,
+                expand=1,
+                padding=25,
+                bgcolor=ft.Colors.WHITE,
+                border_radius=15,
+                margin=ft.margin.only(left=20),
+                border=ft.border.all(1, ft.Colors.GREY_200)
+            )
+        ]
+    )
+    root = ft.Column(controls=[header, search_section], expand=True, spacing=0)
+    page.add(root)
+    metrics.observe("startup_first_paint_ms", (time.perf_counter() - started) * 1000)
+
+    def on_favorites_refreshed(results: Dict[str, CurrentConditions]):
+        weather_app.learn_favorites(results)
+        update_favorites_display()
+
+    def on_weather_published(results: Dict[str, CurrentConditions]):
+        # Refreshes cover every session's cities; pick out the ones shown here
+        api = weather_app.weather_api
+        updated = {api.cache_key("weather", city)[1]: data for city, data in results.items()}
+        if any(api.cache_key("weather", city)[1] in updated for city in weather_app.favorites):
+            on_favorites_refreshed(results)
+        current_city = search_state["city"]
+        if current_city is not None:
+            data = updated.get(api.cache_key("weather", current_city)[1])
+            with render_lock:
+                if data is not None and current_city == search_state["city"]:
+                    show_current_weather(data)
+
+    def watched_cities() -> List[str]:
+        current_city = search_state["city"]
+        return weather_app.favorites + ([current_city] if current_city is not None else [])
+
+    def start_refresher():
+        nonlocal refresher
+        if shared is not None:
+            # The shared refresher keeps running for other sessions; this one only
+            # stops being counted while it is hidden
+            def on_lifecycle_change(e):
+                if e.state in (ft.AppLifecycleState.HIDE, ft.AppLifecycleState.PAUSE):
+                    shared.unwatch(page.session_id)
+                    # Favorites live in the browser, so save them while it still answers
+                    weather_app.favorites_store.flush()
+                elif e.state in (ft.AppLifecycleState.SHOW, ft.AppLifecycleState.RESUME):
+                    shared.watch(page.session_id, watched_cities)
+
+            def on_disconnect(e):
+                shared.unwatch(page.session_id)
+                shared.hub.unsubscribe("weather", on_weather_published)
+                # The browser is gone: a write could only fail and retry forever
+                weather_app.favorites_store.close()
+
+            refresher = shared.refresher
+            shared.hub.subscribe("weather", on_weather_published)
+            shared.watch(page.session_id, watched_cities)
+        else:
+            # Keep every favorite warm in the cache and its sidebar card live
+            refresher = FavoritesRefresher(
+                weather_app.weather_api,
+                cities=lambda: list(weather_app.favorites),
+                on_refresh=on_favorites_refreshed
+            )
+
+            def on_lifecycle_change(e):
+                if e.state in (ft.AppLifecycleState.HIDE, ft.AppLifecycleState.PAUSE):
+                    refresher.pause()
+                elif e.state in (ft.AppLifecycleState.SHOW, ft.AppLifecycleState.RESUME):
+                    refresher.resume()
+
+            def on_disconnect(e):
+                refresher.stop()
+                weather_app.favorites_store.flush()
+
+            refresher.start()
+
+        page.on_app_lifecycle_state_change = on_lifecycle_change
+        page.on_disconnect = on_disconnect
+
+    # Ctrl+Shift+D toggles an overlay with the latest per-stage timings
+    debug_text = ft.Text("", size=11, font_family="monospace", color=ft.Colors.WHITE)
+    debug_overlay = ft.Container(
+        content=debug_text,
+        bgcolor=ft.Colors.with_opacity(0.8, ft.Colors.BLACK),
+        padding=10,
+        border_radius=8,
+        right=10,
+        bottom=10,
+        visible=False
+    )
+    page.overlay.append(debug_overlay)
+
+    def refresh_debug_overlay():
+        while debug_overlay.visible:
+            lines = [
+                f"{name:24} last {stats['last']:9.1f}  p50 {stats['p50']:8.1f}  p99 {stats['p99']:8.1f}  n={stats['count']}"
+                for name, stats in metrics.summary().items()
+            ]
+            debug_text.value = "\n".join(lines) or "No timings recorded yet"
+            ui.mark(debug_overlay)
+            time.sleep(1)
+
+    def on_keyboard(e):
+        if e.key.upper() == "D" and e.ctrl and e.shift:
+            debug_overlay.visible = not debug_overlay.visible
+            ui.mark(debug_overlay)
+            if debug_overlay.visible:
+                page.run_thread(refresh_debug_overlay)
+
+    page.on_keyboard_event = on_keyboard
+
+    def finish_startup():
+        nonlocal weather_app
+        degraded = False
+        try:
+            with metrics.timer("startup_stores_ms"):
+                if shared is not None:
+                    # Server mode: every session shares one fetch layer; favorites stay in each user's browser
+                    favorites_store = ClientFavoritesStore(page.client_storage, resolve=shared.weather_api.resolve_city)
+                    weather_app = WeatherApp(shared.weather_api, favorites_store)
+                else:
+                    weather_app = WeatherApp()
+        except Exception as e:
+            print(f"Error opening saved data: {e}")
+            degraded = True
+            try:
+                if shared is not None:
+                    # Keep the shared cache and budget; never fall back to the
+                    # server's own favorites file, which every session would share
+                    weather_app = WeatherApp(shared.weather_api, MemoryFavoritesStore(resolve=shared.weather_api.resolve_city))
+                else:
+                    # Live weather only: no saved payloads, history or offline city search
+                    weather_app = WeatherApp(WeatherAPI())
+            except Exception as e:
+                print(f"Error starting weather app: {e}")
+                show_status(f"Could not start: {e}", ft.Colors.RED_400)
+        try:
+            if weather_app is not None:
+                with render_lock:
+                    root.controls.append(main_content)
+                    ui.mark(root)
+        finally:
+            # Searches started meanwhile are waiting on this, whatever happened;
+            # by now the controls they update are on the page
+            app_ready.set()
+        if weather_app is None:
+            return
+        update_favorites_display()
+        start_refresher()
+
+        # Open the first favorite, unless a search was started meanwhile or
+        # startup went wrong: the saved copy is painted right away, the live data follows
+        city = weather_app.favorites[0] if weather_app.favorites else None
+        if degraded or city is None or search_state["generation"] or (city_input.value or "").strip():
+            if degraded and shared is not None:
+                show_status("Favorites could not be loaded; changes will not be kept", ft.Colors.ORANGE_600)
+            elif degraded:
+                show_status("Saved data could not be opened; showing live weather only", ft.Colors.ORANGE_600)
+            elif not search_state["generation"]:
+                show_status("Ready to search for weather data", ft.Colors.GREY_600)
+            metrics.observe("startup_ready_ms", (time.perf_counter() - started) * 1000)
+            return
+        city_input.value = city
+        ui.mark(city_input)
+        generation = next_generation()
+        with render_lock:
+            if not show_saved_weather(city, refreshing=True):
+                show_status("Loading weather data...", ft.Colors.BLUE_400)
+        metrics.observe("startup_ready_ms", (time.perf_counter() - started) * 1000)
+        fetch_weather(city, generation)
+        metrics.observe("startup_weather_ms", (time.perf_counter() - started) * 1000)
+
+    page.run_thread(finish_startup)
+
+CURRENT_FIELDS = [
+    "kind", "query", "status", "city_id", "name", "country", "lat", "lon", "dt",
+    "temp", "feels_like", "humidity", "pressure", "wind_speed", "description", "icon"
+]
+DAILY_FIELDS = ["date", "temp_min", "temp_max", "temp_mean", "precipitation", "wind_max"]
+
+def export_rows(query: str, current: Optional[CurrentConditions], forecast: Optional[Forecast],
+                days: int = 5) -> Iterator[Dict[str, Any]]:
+    if current is None:
+        yield {"kind": "current", "query": query, "status": "not_found"}
+        return
+    row = {"kind": "current", "query": query, "status": "ok"}
+    row.update((field, getattr(current, field)) for field in CURRENT_FIELDS[3:])
+    yield row
+    if forecast is None:
+        return
+    for summary in aggregate_daily(forecast, days=days):
+        yield {
+            "kind": "daily", "query": query, "status": "ok", "city_id": current.city_id,
+            "name": current.name, "country": current.country, "date": summary.date.isoformat(),
+            # Forecast columns are float32; don't export their rounding noise
+            "temp_min": round(summary.temp_min, 2), "temp_max": round(summary.temp_max, 2),
+            "temp_mean": round(summary.temp_mean, 2), "precipitation": round(summary.precipitation, 2),
+            "wind_max": round(summary.wind_max, 2), "description": summary.description, "icon": summary.icon,
+        }
+
+def read_city_list(path: str) -> List[str]:
+    # One city per line; blank lines and # comments are skipped
+    stream = sys.stdin if path == "-" else open(path, "r", encoding="utf-8")
+    try:
+        return [line.strip() for line in stream if line.strip() and not line.lstrip().startswith("#")]
+    finally:
+        if stream is not sys.stdin:
+            stream.close()
+
+def run_export(args) -> int:
+    cities = list(args.cities)
+    if args.file:
+        cities.extend(read_city_list(args.file))
+    if args.favorites or not cities:
+        # Only reading the list: a problem with it is reported, never "fixed",
+        # and never papered over by exporting the default cities
+        try:
+            with redirect_stdout(sys.stderr):
+                cities.extend(FavoritesStore(args.favorites_file, read_only=True).names)
+        except (OSError, ValueError) as e:
+            print(f"Error reading favorites: {e}", file=sys.stderr)
+            return 2
+    if not cities:
+        print("No cities to fetch", file=sys.stderr)
+        return 2
+
+    out = sys.stdout if args.output == "-" else open(args.output, "w", encoding="utf-8", newline="")
+    if args.format == "csv":
+        writer = csv.DictWriter(out, fieldnames=CURRENT_FIELDS + DAILY_FIELDS, extrasaction="ignore")
+        writer.writeheader()
+        write = writer.writerow
+    else:
+        write = lambda row: out.write(json.dumps(row, ensure_ascii=False) + "\n")
+
+    # A batch job would rather wait for quota than export stale rows
+    api = WeatherAPI(pool_size=args.workers, city_index=default_city_index(), max_wait=None)
+    # Eight 3-hour steps a day, plus one for the partial first day; ask for no more than that
+    points = 8 * (args.days + 1)
+    failures = 0
+    try:
+        # The API reports problems with print(); keep them out of the data stream
+        with redirect_stdout(sys.stderr):
+            futures = [
+                (city, api.get_current_weather_async(city, args.units),
+                 api.get_forecast_async(city, args.units, points=points) if args.forecast else None)
+                for city in cities
+            ]
+            # Everything is in flight at once; rows go out in input order as they land
+            for city, current_future, forecast_future in futures:
+                current = current_future.result()
+                forecast = forecast_future.result() if forecast_future is not None else None
+                failures += current is None
+                for row in export_rows(city, current, forecast, args.days):
+                    write(row)
+                out.flush()
+    finally:
+        api.close()
+        if out is not sys.stdout:
+            out.close()
+    return 1 if failures else 0
+
+def run_dashboard(args) -> int:
+    if ft is None:
+        print("The dashboard needs Flet: pip install flet", file=sys.stderr)
+        return 2
+    if os.environ.get("WEATHER_METRICS_PORT"):
+        metrics.serve_prometheus(int(os.environ["WEATHER_METRICS_PORT"]))
+    ft.app(target=weatherapp, assets_dir="assets")
+    return 0
+
+def run_server(args) -> int:
+    if ft is None:
+        print("Server mode needs Flet: pip install flet", file=sys.stderr)
+        return 2
+    if os.environ.get("WEATHER_METRICS_PORT"):
+        metrics.serve_prometheus(int(os.environ["WEATHER_METRICS_PORT"]))
+    # One fetch layer for the whole process; sessions only add their own views
+    shared = SharedWeather()
+    ft.app(
+        target=functools.partial(weatherapp, shared=shared),
+        host=args.host,
+        port=args.port,
+        view=None if args.no_browser else ft.AppView.WEB_BROWSER,
+        assets_dir="assets"
+    )
+    return 0
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Weather dashboard and headless exporter")
+    commands = parser.add_subparsers(dest="command")
+    commands.add_parser("gui", help="open the dashboard (default)")
+    serve = commands.add_parser("serve", help="serve the dashboard to browsers, sharing one cache across sessions")
+    serve.add_argument("--host", default=None, help="interface to listen on (default: all)")
+    serve.add_argument("--port", type=int, default=8550)
+    serve.add_argument("--no-browser", action="store_true", help="don't open a browser on the server")
+    export = commands.add_parser("export", help="fetch cities without the GUI and write JSONL or CSV")
+    export.add_argument("cities", nargs="*", help="city names; defaults to the saved favorites")
+    export.add_argument("--file", help="read city names from this file, one per line ('-' for stdin)")
+    export.add_argument("--favorites", action="store_true", help="include the saved favorite cities")
+    export.add_argument("--favorites-file", default="favorite_cities.json")
+    export.add_argument("--format", choices=("jsonl", "csv"), default="jsonl")
+    export.add_argument("--output", default="-", help="output file ('-' for stdout)")
+    export.add_argument("--forecast", action="store_true", help="add one row per forecast day")
+    export.add_argument("--days", type=int, choices=range(1, 6), default=5, metavar="1-5",
+                        help="forecast days to export; fewer days download less")
+    export.add_argument("--units", choices=("metric", "imperial", "standard"), default="metric")
+    export.add_argument("--workers", type=int, default=10, help="concurrent upstream requests")
+    args = parser.parse_args(argv)
+    if args.command == "export":
+        return run_export(args)
+    if args.command == "serve":
+        return run_server(args)
+    return run_dashboard(args)
+
+if __name__ == "__main__":
+    sys.exit(main())